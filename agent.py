@@ -1,17 +1,35 @@
 from __future__ import annotations
-import json, os, re, math
-from typing import Any, Dict, Optional
-from openai import OpenAI
+import asyncio, contextvars, json, os, re, math, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+import fileindex
+import fileio
+import lmclient
+import lmmetrics
+import lmtrace
+from jsonscan import extract_last_json_dict, repair_json_dict
+from lmcache import PlanCache, ResponseCache
+from toolspec import PLAN_RESPONSE_FORMAT, TOOL_SCHEMAS, drop_nulls, parse_arguments, tool_reply
 
 # -----------------------------------------------------------
 # BASIC LOCAL CONFIG
 # -----------------------------------------------------------
-LM = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
-MODEL = "qwen2.5-vl-3b-instruct"   # set to the model name you loaded in LM Studio
+# Base URL, pool and timeouts come from LMSTUDIO_* (see lmclient.py)
+# openai is imported on the first LLM call, so direct commands start instantly
+LM = lmclient.LazyClient()
+ALM = lmclient.LazyClient(asynchronous=True)  # shared by all *_async calls
+MODEL = lmclient.model("qwen2.5-vl-3b-instruct")   # or set LMSTUDIO_MODEL to the model loaded in LM Studio
 ROOT  = os.path.abspath(os.getcwd())
+READ_MAX_CHARS = 4000   # read_file returns at most this much of a file
 
 PLAN_CONF_THRESHOLD = 0.6
-WHITELIST_TOOLS = {"read_file", "write_file", "calc", "find_number"}
+FAST_ROUTE_THRESHOLD = 0.85   # fast_route() confidence needed to skip the planner call
+SINGLE_CALL_ROUTING = False   # one call returns either a tool call or the chat answer (see ROUTE_ANSWER_SYSTEM)
+SPECULATIVE_CHAT = False      # start the chat answer while the planner runs; cancel it if not needed
+NATIVE_TOOLS = False          # route via the tools= parameter and structured tool_calls instead of JSON-in-text
+STRUCTURED_OUTPUT = False     # constrain the planner to a JSON schema (response_format=json_schema)
+STREAM = True   # stream completions so TTFT / tokens-per-sec are recorded per call
+WHITELIST_TOOLS = {"read_file", "write_file", "search_files", "calc", "find_number"}
 
 # Accept paths like: notes.txt, seft/deg.log, ./foo, foo.bar.gz
 PATH_RE = re.compile(r"(?:\./|/)?[A-Za-z0-9._/\-]+\.[A-Za-z0-9]{1,8}")
@@ -27,6 +45,15 @@ RE_NUM   = re.compile(r"^!num\s+(.+)$",  re.IGNORECASE)
 # Persistent session context
 known_files: set[str] = set()
 
+# Planner replies are deterministic (temperature 0), so cache them.
+# Set AGENT_PLAN_CACHE to a file path to keep plans across restarts.
+PLAN_CACHE = PlanCache(max_entries=256, ttl=24 * 3600.0, path=os.environ.get("AGENT_PLAN_CACHE") or None)
+
+# Temperature-0 completions are cached by content hash. LLM_CACHE_PATH keeps
+# them on disk; LLM_CACHE=0 bypasses the cache.
+RESPONSE_CACHE = ResponseCache(path=os.environ.get("LLM_CACHE_PATH") or ":memory:",
+                               enabled=os.environ.get("LLM_CACHE", "1") != "0")
+
 # -----------------------------------------------------------
 # TOOL IMPLEMENTATIONS
 # -----------------------------------------------------------
@@ -38,9 +65,16 @@ def read_file(args: Dict[str, Any]) -> str:
     if not abs_path.startswith(ROOT):
         return "ERROR: path outside project"
     if not os.path.isfile(abs_path):
-        return f"ERROR: file not found: {path}"
-    with open(abs_path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read()[:4000]
+        return f"ERROR: file not found: {path}{_did_you_mean(path)}"
+    try:
+        res = fileio.cached_read(abs_path, READ_MAX_CHARS, **{k: args.get(k) for k in fileio.WINDOW_ARGS})
+    except ValueError as e:
+        return f"ERROR: {e}"
+    return fileio.render(res)
+
+def _did_you_mean(path: str) -> str:
+    found = fileindex.dir_index_for(ROOT).find(os.path.basename(path))
+    return f" (did you mean {', '.join(found[:3])}?)" if found else ""
 
 def write_file(args: Dict[str, Any]) -> str:
     path = args.get("path", "")
@@ -53,10 +87,25 @@ def write_file(args: Dict[str, Any]) -> str:
     try:
         with open(abs_path, "w", encoding="utf-8") as f:
             f.write(text)
+        fileio.CACHE.invalidate(abs_path)
+        fileindex.changed(ROOT, abs_path)
         return f"[wrote {len(text)} chars to {path}]"
     except Exception as e:
         return f"ERROR: {e}"
 
+SEARCH_MAX_HITS = 20
+
+def search_files(args: Dict[str, Any]) -> str:
+    query = str(args.get("query", "")).strip()
+    if not query:
+        return "ERROR: missing query"
+    regex = args.get("regex") in (True, 1, "1", "true", "True")
+    try:
+        hits = fileindex.index_for(ROOT).search(query, regex=regex, max_hits=SEARCH_MAX_HITS)
+    except re.error as e:
+        return f"ERROR: bad regex: {e}"
+    return fileindex.format_hits(hits, SEARCH_MAX_HITS)
+
 SAFE_EXPR = re.compile(r"^[0-9+\-*/().\s^]*$")
 def calc(args: Dict[str, Any]) -> str:
     expr = str(args.get("expr", ""))
@@ -76,6 +125,7 @@ def find_number(args: Dict[str, Any]) -> str:
 
 TOOLS = {
     "read_file": read_file,
+    "search_files": search_files,
     "write_file": write_file,
     "calc": calc,
     "find_number": find_number,
@@ -84,57 +134,255 @@ TOOLS = {
 # -----------------------------------------------------------
 # LLM CORE
 # -----------------------------------------------------------
-def llm(messages, temperature=0.3, max_tokens=500) -> str:
-    resp = LM.chat.completions.create(
+# Timing of the most recent llm() call in the current thread / asyncio task:
+# elapsed, ttft (s), tokens, tok_per_s. A context variable, so concurrent
+# queries (batch.py, speculative chat) never see each other's numbers.
+# Every call is also recorded, with its stage, in lmmetrics.
+_last_call: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("agent_last_call", default={})
+
+def last_call_stats() -> Dict[str, Any]:
+    return _last_call.get()
+
+def _completion_kwargs(messages, temperature, max_tokens, response_format=None, **extra) -> Dict[str, Any]:
+    return dict(
+        model=MODEL,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        response_format=response_format or {"type": "text"},
+        **extra,
+    )
+
+def _chunk_text(chunk) -> str:
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+def _record_stats(t0: float, ttft: Optional[float], tokens: int, stage: str,
+                  outcome: str = "ok", usage: Any = None) -> None:
+    elapsed = time.perf_counter() - t0
+    decode = elapsed - ttft if ttft is not None else 0.0
+    prompt_tokens, completion_tokens = lmmetrics.usage_tokens(usage)
+    if completion_tokens is None and tokens:
+        completion_tokens = tokens
+    _last_call.set(dict(
+        elapsed=elapsed, ttft=ttft, tokens=completion_tokens or 0,
+        tok_per_s=((completion_tokens or 0) / decode) if decode > 0 else 0.0,
+        cached=outcome == "cached", stage=stage,
+    ))
+    lmmetrics.record(MODEL, stage, outcome, elapsed, ttft, prompt_tokens, completion_tokens)
+    lmtrace.complete(stage, "llm", t0, elapsed, outcome=outcome, ttft=ttft,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+def _error_outcome(e: BaseException) -> str:
+    if isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+        return "stopped"
+    return f"error: {type(e).__name__}"
+
+def _create(stage: str, **kwargs):
+    """Non-streamed completion, recorded in lmmetrics."""
+    t0 = time.perf_counter()
+    try:
+        resp = LM.chat.completions.create(**kwargs)
+    except BaseException as e:
+        _record_stats(t0, None, 0, stage, _error_outcome(e))
+        raise
+    _record_stats(t0, None, 0, stage, usage=getattr(resp, "usage", None))
+    return resp
+
+async def _create_async(stage: str, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        resp = await ALM.chat.completions.create(**kwargs)
+    except BaseException as e:
+        _record_stats(t0, None, 0, stage, _error_outcome(e))
+        raise
+    _record_stats(t0, None, 0, stage, usage=getattr(resp, "usage", None))
+    return resp
+
+def _cache_key(messages, temperature, max_tokens, response_format=None) -> Optional[str]:
+    """Response-cache key, or None when sampling makes the reply non-deterministic."""
+    if temperature != 0.0 or not RESPONSE_CACHE.enabled:
+        return None
+    return ResponseCache.key(MODEL, messages, temperature=temperature, max_tokens=max_tokens,
+                             response_format=response_format)
+
+def _cache_hit(key: Optional[str], on_token, stage: str) -> Optional[str]:
+    if key is None:
+        return None
+    t0 = time.perf_counter()
+    text = RESPONSE_CACHE.get(key)
+    if text is not None:
+        if on_token is not None:
+            on_token(text)
+        _record_stats(t0, None, 0, stage, "cached")
+    return text
+
+def llm_stream(messages, temperature=0.3, max_tokens=500, response_format=None,
+               stage: str = "chat", on_open: Optional[Callable[[Callable[[], None]], None]] = None) -> Iterator[str]:
+    """Yield completion text deltas as they arrive; sets last_call_stats() when done.
+
+    on_open, if given, receives a function that closes the HTTP stream (from
+    any thread), which stops generation on the server at once.
+    """
+    t0 = time.perf_counter()
+    ttft = None
+    tokens = 0
+    usage = None
+    outcome = "ok"
+    stream = None
+    closed = threading.Event()
+
+    def close() -> None:
+        closed.set()
+        stream.close()
+
+    try:
+        stream = LM.chat.completions.create(
+            **_completion_kwargs(messages, temperature, max_tokens, response_format,
+                                 stream=True, stream_options={"include_usage": True}))
+        if on_open is not None:
+            on_open(close)
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            delta = _chunk_text(chunk)
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            tokens += 1   # LM Studio sends one token per chunk
+            yield delta
+    except BaseException as e:
+        outcome = "stopped" if closed.is_set() else _error_outcome(e)
+        raise
+    finally:
+        if stream is not None:
+            stream.close()
+        _record_stats(t0, ttft, tokens, stage, outcome, usage)
+
+def llm(messages, temperature=0.3, max_tokens=500,
+        on_token: Optional[Callable[[str], None]] = None, response_format=None,
+        stage: str = "chat") -> str:
+    key = _cache_key(messages, temperature, max_tokens, response_format)
+    out = _cache_hit(key, on_token, stage)
+    if out is not None:
+        return out
+    if STREAM or on_token is not None:
+        parts = []
+        for delta in llm_stream(messages, temperature=temperature, max_tokens=max_tokens,
+                                response_format=response_format, stage=stage):
+            if on_token is not None:
+                on_token(delta)
+            parts.append(delta)
+        out = "".join(parts)
+    else:
+        resp = _create(stage, **_completion_kwargs(messages, temperature, max_tokens, response_format))
+        out = resp.choices[0].message.content or ""
+    if key is not None:
+        RESPONSE_CACHE.put(key, out)
+    return out
+
+async def llm_stream_async(messages, temperature=0.3, max_tokens=500, response_format=None,
+                           stage: str = "chat") -> AsyncIterator[str]:
+    t0 = time.perf_counter()
+    ttft = None
+    tokens = 0
+    usage = None
+    outcome = "ok"
+    stream = None
+    try:
+        stream = await ALM.chat.completions.create(
+            **_completion_kwargs(messages, temperature, max_tokens, response_format,
+                                 stream=True, stream_options={"include_usage": True}))
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            delta = _chunk_text(chunk)
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+            tokens += 1
+            yield delta
+    except BaseException as e:
+        outcome = _error_outcome(e)
+        raise
+    finally:
+        if stream is not None:
+            await stream.close()
+        _record_stats(t0, ttft, tokens, stage, outcome, usage)
+
+async def llm_async(messages, temperature=0.3, max_tokens=500,
+                    on_token: Optional[Callable[[str], None]] = None, response_format=None,
+                    stage: str = "chat") -> str:
+    key = _cache_key(messages, temperature, max_tokens, response_format)
+    out = _cache_hit(key, on_token, stage)
+    if out is not None:
+        return out
+    if STREAM or on_token is not None:
+        parts = []
+        async for delta in llm_stream_async(messages, temperature=temperature, max_tokens=max_tokens,
+                                            response_format=response_format, stage=stage):
+            if on_token is not None:
+                on_token(delta)
+            parts.append(delta)
+        out = "".join(parts)
+    else:
+        resp = await _create_async(stage, **_completion_kwargs(messages, temperature, max_tokens, response_format))
+        out = resp.choices[0].message.content or ""
+    if key is not None:
+        RESPONSE_CACHE.put(key, out)
+    return out
+
+def _tools_kwargs(messages, tool_choice, temperature, max_tokens) -> Dict[str, Any]:
+    return dict(
         model=MODEL,
         messages=messages,
+        tools=TOOL_SCHEMAS,
+        tool_choice=tool_choice,
         temperature=temperature,
         max_tokens=max_tokens,
-        response_format={"type": "text"},
     )
-    return resp.choices[0].message.content or ""
+
+def llm_tools(messages, tool_choice="auto", temperature=0.3, max_tokens=600, stage: str = "native") -> Dict[str, Any]:
+    """One non-streamed call with TOOL_SCHEMAS; returns toolspec.tool_reply() output."""
+    resp = _create(stage, **_tools_kwargs(messages, tool_choice, temperature, max_tokens))
+    return tool_reply(resp.choices[0].message)
+
+async def llm_tools_async(messages, tool_choice="auto", temperature=0.3, max_tokens=600,
+                          stage: str = "native") -> Dict[str, Any]:
+    resp = await _create_async(stage, **_tools_kwargs(messages, tool_choice, temperature, max_tokens))
+    return tool_reply(resp.choices[0].message)
 
 # -----------------------------------------------------------
 # PLANNER
 # -----------------------------------------------------------
+TOOL_ARGS_HINT = (
+    "- read_file args: path; optionally tail (last N lines), start_line + end_line (1-based), "
+    "or offset + length (bytes)\n"
+    "- search_files args: query (words to find in the project's files); regex: true to use a regular expression\n"
+)
+
 PLANNER_SYSTEM = (
     "You are a router. Decide how to handle the user's request.\n"
     "Return ONE JSON object only with keys: route, tool, args, confidence.\n"
     "- route: 'tool' or 'chat'\n"
-    "- tool: one of ['read_file','write_file','calc','find_number'] or null when route='chat'\n"
+    "- tool: one of ['read_file','write_file','search_files','calc','find_number'] or null when route='chat'\n"
     "- args: object of arguments for the chosen tool ({} if none)\n"
+    f"{TOOL_ARGS_HINT}"
     "- confidence: float 0.0..1.0 (your certainty)\n"
     "No prose. No markdown. JSON only."
 )
 
-def extract_last_json_dict(text: str) -> Optional[Dict[str, Any]]:
-    start = -1
-    depth = 0
-    last = None
-    for i, ch in enumerate(text or ""):
-        if ch == "{":
-            if depth == 0:
-                start = i
-            depth += 1
-        elif ch == "}":
-            if depth > 0:
-                depth -= 1
-                if depth == 0 and start != -1:
-                    frag = text[start:i+1]
-                    try:
-                        obj = json.loads(frag)
-                        if isinstance(obj, dict):
-                            last = obj
-                    except Exception:
-                        pass
-    return last
-
-def plan_route(user_prompt: str) -> Dict[str, Any]:
-    messages = [
+def _planner_messages(user_prompt: str):
+    return [
         {"role": "system", "content": PLANNER_SYSTEM},
         {"role": "user", "content": user_prompt},
     ]
-    raw = llm(messages, temperature=0.0, max_tokens=200).strip()
+
+plan_repairs = {"repaired": 0}
+
+def _parse_plan(raw: str) -> Dict[str, Any]:
+    raw = raw.strip()
     try:
         obj = json.loads(raw)
         if isinstance(obj, dict):
@@ -142,8 +390,68 @@ def plan_route(user_prompt: str) -> Dict[str, Any]:
     except Exception:
         pass
     obj = extract_last_json_dict(raw)
+    if obj is None:
+        # Sloppy JSON (quotes, fences, trailing commas): fix it here rather
+        # than dropping to the fallback path and paying another call.
+        obj = repair_json_dict(raw)
+        if obj:
+            plan_repairs["repaired"] += 1
     return obj or {}
 
+def _plan_format() -> Optional[Dict[str, Any]]:
+    return PLAN_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None
+
+def _plan_keys(user_prompt: str) -> Tuple[str, str]:
+    # Tool plans carry arguments copied from the prompt ("write Hello to a.txt"),
+    # so they are reused only for the exact prompt; chat plans for any prompt
+    # that differs just in case and whitespace.
+    fmt = _plan_format()
+    return (PlanCache.key(MODEL, PLANNER_SYSTEM, user_prompt, fmt, exact=True),
+            PlanCache.key(MODEL, PLANNER_SYSTEM, user_prompt, fmt))
+
+def _cached_plan(user_prompt: str) -> Optional[Dict[str, Any]]:
+    return PLAN_CACHE.get(*_plan_keys(user_prompt))
+
+def _remember_plan(user_prompt: str, plan: Dict[str, Any]) -> None:
+    exact, normalized = _plan_keys(user_prompt)
+    PLAN_CACHE.put(normalized if plan.get("route") == "chat" else exact, plan)
+
+def _plan_from_llm(user_prompt: str) -> Dict[str, Any]:
+    plan = _parse_plan(llm(_planner_messages(user_prompt), temperature=0.0, max_tokens=200,
+                           response_format=_plan_format(), stage="planner"))
+    if plan:
+        _remember_plan(user_prompt, plan)
+    return plan
+
+async def _plan_from_llm_async(user_prompt: str) -> Dict[str, Any]:
+    plan = _parse_plan(await llm_async(_planner_messages(user_prompt), temperature=0.0, max_tokens=200,
+                                       response_format=_plan_format(), stage="planner"))
+    if plan:
+        _remember_plan(user_prompt, plan)
+    return plan
+
+@lmtrace.traced("plan_route")
+def plan_route(user_prompt: str) -> Dict[str, Any]:
+    plan = _cached_plan(user_prompt)
+    return plan if plan is not None else _plan_from_llm(user_prompt)
+
+@lmtrace.traced("plan_route")
+async def plan_route_async(user_prompt: str) -> Dict[str, Any]:
+    plan = _cached_plan(user_prompt)
+    return plan if plan is not None else await _plan_from_llm_async(user_prompt)
+
+# Single-call protocol: the router answers chat prompts itself, so chat-routed
+# prompts cost one call instead of planner + chat.
+ROUTE_ANSWER_SYSTEM = (
+    "You are a helpful assistant with tools. Either call one tool or answer directly.\n"
+    "Return ONE JSON object only, in one of these forms:\n"
+    '- {"tool": "<name>", "args": {...}} with tool one of '
+    "['read_file','write_file','search_files','calc','find_number'] when the request needs it\n"
+    f"{TOOL_ARGS_HINT}"
+    '- {"final": "<your full answer>"} for everything else\n'
+    "No prose or markdown outside the JSON."
+)
+
 def valid_tool_choice(tool: str, args: Dict[str, Any]) -> bool:
     if tool not in WHITELIST_TOOLS:
         return False
@@ -151,6 +459,8 @@ def valid_tool_choice(tool: str, args: Dict[str, Any]) -> bool:
         return False
     if tool == "write_file" and not all(k in args for k in ("path", "text")):
         return False
+    if tool == "search_files" and not str(args.get("query", "")).strip():
+        return False
     if tool == "calc" and "expr" not in args:
         return False
     if tool == "find_number" and "text" not in args:
@@ -160,22 +470,17 @@ def valid_tool_choice(tool: str, args: Dict[str, Any]) -> bool:
 # -----------------------------------------------------------
 # HEURISTIC FALLBACK + CONTEXT MEMORY
 # -----------------------------------------------------------
-def autowrap_to_action(raw: str, user_prompt: str) -> dict:
-    raw = (raw or "").strip()
-    up  = user_prompt.strip()
-
+def remember_declared_files(up: str) -> None:
     # Detect "X is a file" declarations → remember it
     m = re.findall(r"\b([A-Za-z0-9_\-./]+)\b\s+is\s+a\s+file", up, re.IGNORECASE)
     for name in m:
         known_files.add(name.strip().lower())
 
-    # Direct JSON pass-through
-    try:
-        data = json.loads(raw)
-        if isinstance(data, dict) and ("tool" in data or "final" in data):
-            return data
-    except Exception:
-        pass
+@lmtrace.traced("heuristic")
+def _prompt_action(user_prompt: str) -> Optional[Dict[str, Any]]:
+    """The tool action the prompt alone implies (a file it names, a trailing expression), or None."""
+    up = user_prompt.strip()
+    remember_declared_files(up)
 
     # Detect explicit path-like names with extension
     mp = PATH_RE.search(up)
@@ -188,22 +493,104 @@ def autowrap_to_action(raw: str, user_prompt: str) -> dict:
         if re.search(rf"\b{re.escape(name)}\b", up, re.IGNORECASE):
             return {"tool": "read_file", "args": {"path": name}}
 
-    # Bare filename fallback by filesystem probe
+    # Bare filename fallback via the directory index (no stat per token)
+    files = fileindex.dir_index_for(ROOT)
     tokens = re.findall(r"[A-Za-z0-9._/\-]+", up)
     for token in tokens:
-        if os.path.isfile(os.path.join(ROOT, token)):
+        if files.has(token):
             return {"tool": "read_file", "args": {"path": token}}
 
     # Arithmetic intent: trailing expression
     cm = re.search(r"([-+/*()\s.\d^]+)$", up)
     if cm and re.search(r"\d", cm.group(1)):
         return {"tool": "calc", "args": {"expr": cm.group(1).strip()}}
+    return None
+
+_UNSET: Any = object()
+
+@lmtrace.traced("autowrap")
+def autowrap_to_action(raw: str, user_prompt: str, prompt_action: Any = _UNSET) -> dict:
+    """Turn a free-form reply into {"tool", "args"} or {"final"}.
+
+    prompt_action is _prompt_action(user_prompt) when the caller already has it.
+    """
+    raw = (raw or "").strip()
+    remember_declared_files(user_prompt.strip())
+
+    # Direct JSON pass-through
+    try:
+        data = json.loads(raw)
+        if isinstance(data, dict) and ("tool" in data or "final" in data):
+            return data
+    except Exception:
+        pass
 
+    action = _prompt_action(user_prompt) if prompt_action is _UNSET else prompt_action
+    if action is not None:
+        return action
     return {"final": raw[:4000] or "(no output)"}
 
+# -----------------------------------------------------------
+# FAST-PATH ROUTER (no model)
+# -----------------------------------------------------------
+READ_INTENT = re.compile(r"\b(what\s+is\s+in|what's\s+in|show|display|print|read|open|cat|contents?\s+of)\b",
+                         re.IGNORECASE)
+WRITE_INTENT = re.compile(r"\b(write|save|append|create|edit|update|change|delete|remove|rename|put)\b",
+                          re.IGNORECASE)
+ARITH_RE = re.compile(r"^(calc(?:ulate)?|compute|evaluate|what\s+is|what's)?\s*([-+*/()\s.\d^]+?)\s*[=?]*$",
+                      re.IGNORECASE)
+ARITH_OP = re.compile(r"[\d)]\s*[-+*/^]\s*[-\d(.]")
+ARITH_OP_NOT_MINUS = re.compile(r"[\d)]\s*[+*/^]\s*[-\d(.]")   # "2024-10-15", "555-1234" only have '-'
+
+@lmtrace.traced("fast_route")
+def fast_route(user_prompt: str) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Rule-based routing for unambiguous prompts.
+
+    Returns (action, confidence); action is a {"tool", "args"} dict or None.
+    Only prompts scoring >= FAST_ROUTE_THRESHOLD skip plan_route().
+    """
+    up = user_prompt.strip()
+    remember_declared_files(up)
+    if not up:
+        return None, 0.0
+
+    # Whole prompt is an arithmetic expression ("12*7", "calc 2^10", "what is (3+4)*2?")
+    # (dashes alone, as in dates and phone numbers, need an explicit "calc" / "what is")
+    am = ARITH_RE.match(up)
+    if am and ARITH_OP.search(am.group(2)) and (am.group(1) or ARITH_OP_NOT_MINUS.search(am.group(2))):
+        return {"tool": "calc", "args": {"expr": am.group(2).strip()}}, 0.95
+
+    # Anything that may modify a file is left to the planner
+    if WRITE_INTENT.search(up):
+        return None, 0.0
+    reading = bool(READ_INTENT.search(up))
+
+    # Explicit path-like name: confident only if it exists under ROOT
+    mp = PATH_RE.search(up)
+    if mp:
+        path = mp.group(0).rstrip('.,!?:;\'")')
+        if not fileindex.dir_index_for(ROOT).has(path):
+            return {"tool": "read_file", "args": {"path": path}}, 0.4
+        bare = up.rstrip('.,!?:;\'")') == mp.group(0).rstrip('.,!?:;\'")')
+        return {"tool": "read_file", "args": {"path": path}}, 0.95 if (reading or bare) else 0.6
+
+    # Known file by bare name
+    for name in known_files:
+        if re.search(rf"\b{re.escape(name)}\b", up, re.IGNORECASE):
+            return {"tool": "read_file", "args": {"path": name}}, 0.9 if reading else 0.6
+
+    # Bare filename present under ROOT (directory index, not one stat per token)
+    files = fileindex.dir_index_for(ROOT)
+    for token in re.findall(r"[A-Za-z0-9._/\-]+", up):
+        if files.has(token):
+            return {"tool": "read_file", "args": {"path": token}}, 0.9 if reading else 0.5
+
+    return None, 0.0
+
 # -----------------------------------------------------------
 # DIRECT COMMANDS
 # -----------------------------------------------------------
+@lmtrace.traced("direct")
 def handle_direct_command(q: str) -> Optional[str]:
     m = RE_READ.match(q)
     if m:
@@ -223,12 +610,218 @@ def handle_direct_command(q: str) -> Optional[str]:
 # -----------------------------------------------------------
 # RUN LOOP
 # -----------------------------------------------------------
-def run_query(user_input: str) -> str:
+CHAT_SYSTEM = "You are a helpful assistant."
+FALLBACK_SYSTEM = "You are an assistant. Respond naturally."
+
+def _messages(system: str, q: str):
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": q},
+    ]
+
+def _plan_fields(plan: Dict[str, Any], force_agent: bool) -> Tuple[str, Any, Dict[str, Any], float]:
+    """Pull (route, tool, args, confidence) out of a planner reply."""
+    tool = plan.get("tool", None)
+    args = drop_nulls(plan["args"]) if isinstance(plan.get("args"), dict) else {}
+    if force_agent:
+        return "tool", tool, args, 1.0  # force tool mode branch consideration
+    route = str(plan.get("route", "")).lower()
+    try:
+        conf = float(plan.get("confidence", 0.0))
+    except Exception:
+        conf = 0.0
+    return route, tool, args, conf
+
+def _confident_tool_action(route, tool, args, conf, force_agent, q) -> Optional[Dict[str, Any]]:
+    """First action for the confident tool branch, or None to fall through."""
+    if (route == "tool" and (force_agent or conf >= PLAN_CONF_THRESHOLD)
+            and (tool is None or valid_tool_choice(tool, args))):
+        # If planner proposed a specific tool with valid args, run it;
+        # otherwise fall back to heuristic inference to build the first action.
+        if tool and valid_tool_choice(tool, args):
+            return {"tool": tool, "args": args}
+        # Heuristic to decide first tool action (e.g., read_file on path, calc on expr)
+        return _prompt_action(q)
+    return None
+
+def _run_action(data: Dict[str, Any]) -> str:
+    t = data["tool"]
+    a = data.get("args", {})
+    fn = TOOLS.get(t)
+    if not fn:
+        return f"ERROR: unknown tool '{t}'"
+    with lmtrace.span(t, "tool"):
+        res = fn(a)
+    return res if t == "read_file" else f"[TOOL RESULT] {res}"
+
+async def _run_action_async(data: Dict[str, Any]) -> str:
+    # Tools do blocking file I/O; keep them off the event loop
+    return await asyncio.to_thread(_run_action, data)
+
+def _fallback_result(raw: str, q: str, prompt_action: Any = _UNSET) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Autowrap the fallback reply: (tool action, "") or (None, final text)."""
+    data = autowrap_to_action(raw, q, prompt_action)
+    if "tool" in data:
+        return data, ""
+    if "final" in data:
+        return None, data["final"]
+    return None, "ERROR: no valid result"
+
+_SPEC_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="spec-chat")
+
+class _SpeculativeChat:
+    """A chat completion started before the plan is known.
+
+    Deltas are buffered until claim() hands them (and the rest of the
+    stream) to on_token; cancel() closes the HTTP stream so LM Studio stops
+    generating the discarded answer.
+    """
+
+    def __init__(self, messages) -> None:
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._parts: list[str] = []
+        self._sink: Optional[Callable[[str], None]] = None
+        self._close: Optional[Callable[[], None]] = None
+        self.stats: Dict[str, Any] = {}
+        self._future = _SPEC_POOL.submit(self._run, messages)
+
+    def _run(self, messages) -> str:
+        gen = llm_stream(messages, temperature=0.3, max_tokens=600, stage="chat (speculative)",
+                         on_open=self._opened)
+        try:
+            for delta in gen:
+                if self._cancelled.is_set():
+                    break
+                with self._lock:
+                    self._parts.append(delta)
+                    sink = self._sink
+                if sink is not None:
+                    sink(delta)
+        finally:
+            gen.close()
+            self.stats = last_call_stats()
+        return "".join(self._parts)
+
+    def claim(self, on_token: Optional[Callable[[str], None]]) -> str:
+        with self._lock:
+            if on_token is not None:
+                if self._parts:
+                    on_token("".join(self._parts))
+                self._sink = on_token
+        out = self._future.result()
+        _last_call.set(self.stats)   # the call ran in a pool thread's context
+        return out
+
+    def _opened(self, close: Callable[[], None]) -> None:
+        with self._lock:
+            self._close = close
+        if self._cancelled.is_set():
+            close()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self._future.cancel()
+        with self._lock:
+            close = self._close
+        if close is not None:
+            close()
+
+class _SpeculativeChatAsync:
+    """asyncio counterpart of _SpeculativeChat; cancel() cancels the task, which closes the stream."""
+
+    def __init__(self, messages) -> None:
+        self._parts: list[str] = []
+        self._sink: Optional[Callable[[str], None]] = None
+        self.stats: Dict[str, Any] = {}
+        self._task = asyncio.create_task(self._run(messages))
+
+    async def _run(self, messages) -> str:
+        async for delta in llm_stream_async(messages, temperature=0.3, max_tokens=600, stage="chat (speculative)"):
+            self._parts.append(delta)
+            if self._sink is not None:
+                self._sink(delta)
+        self.stats = last_call_stats()
+        return "".join(self._parts)
+
+    async def claim(self, on_token: Optional[Callable[[str], None]]) -> str:
+        if on_token is not None:
+            if self._parts:
+                on_token("".join(self._parts))
+            self._sink = on_token
+        out = await self._task
+        _last_call.set(self.stats)   # the task ran in a copy of our context
+        return out
+
+    def cancel(self) -> None:
+        self._task.cancel()
+        # a task that already failed would otherwise log "Task exception was never retrieved"
+        self._task.add_done_callback(_retrieve_exception)
+
+def _retrieve_exception(task: "asyncio.Task[Any]") -> None:
+    if not task.cancelled():
+        task.exception()
+
+def _single_call_outcome(raw: str, q: str, force_agent: bool) -> Tuple[str, Optional[Dict[str, Any]], str]:
+    """Interpret a ROUTE_ANSWER_SYSTEM reply as (route, tool action or None, final text)."""
+    obj = _parse_plan(raw)
+    tool = obj.get("tool")
+    args = obj.get("args") if isinstance(obj.get("args"), dict) else {}
+    if tool and valid_tool_choice(tool, args):
+        return "tool", {"tool": tool, "args": args}, ""
+    if force_agent:
+        action = _confident_tool_action("tool", None, {}, 1.0, True, q)
+        if action is not None:
+            return "tool", action, ""
+    if "final" in obj:
+        return "chat", None, str(obj["final"]).strip()
+    # Model ignored the protocol: treat the reply like the fallback path does
+    action, final = _fallback_result(raw, q)
+    return "fallback", action, final
+
+def _native_outcome(reply: Dict[str, Any], q: str, force_agent: bool) -> Tuple[str, Optional[Dict[str, Any]], str]:
+    """Interpret an llm_tools() reply as (route, tool action or None, final text)."""
+    for call in reply["tool_calls"][:1]:
+        args = parse_arguments(call["arguments"])
+        if valid_tool_choice(call["name"], args):
+            return "tool", {"tool": call["name"], "args": args}, ""
+    if force_agent:
+        action = _confident_tool_action("tool", None, {}, 1.0, True, q)
+        if action is not None:
+            return "tool", action, ""
+    content = reply["content"].strip()
+    if content and not reply["tool_calls"]:
+        return "chat", None, content
+    action, final = _fallback_result(content, q)
+    return "fallback", action, final
+
+def _note(info: Optional[Dict[str, Any]], route: str, tool: Optional[str] = None) -> None:
+    lmtrace.instant("route", route=route, tool=tool)
+    if info is not None:
+        info["route"] = route
+        info["tool"] = tool
+
+def _direct_tool(q: str) -> str:
+    for name, rx in (("read_file", RE_READ), ("write_file", RE_WRITE), ("calc", RE_CALC), ("find_number", RE_NUM)):
+        if rx.match(q):
+            return name
+    return ""
+
+@lmtrace.traced("run_query")
+def run_query(user_input: str, on_token: Optional[Callable[[str], None]] = None,
+              info: Optional[Dict[str, Any]] = None) -> str:
+    """Answer one prompt.
+
+    on_token, if given, receives chat text as it streams. info, if given, is
+    filled with the route taken ("direct", "sentinel_chat", "fast", "tool",
+    "chat", "fallback") and the tool that ran (or None).
+    """
     q = user_input.strip()
 
     # --- DIRECT COMMANDS (no model) ---
     direct = handle_direct_command(q)
     if direct is not None:
+        _note(info, "direct", _direct_tool(q))
         return direct
 
     # --- EXPLICIT SENTINELS ---
@@ -236,82 +829,152 @@ def run_query(user_input: str) -> str:
     if q.startswith(SENTINEL_AGENT):
         force_agent = True
         q = q[len(SENTINEL_AGENT):].lstrip()
+        lmtrace.instant("sentinel", mode="agent")
     elif q.startswith(SENTINEL_CHAT):
         # Force free chat; bypass planner & heuristics
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": q},
-        ]
-        return llm(messages, temperature=0.3, max_tokens=600).strip()
-
-    # --- PLANNER PASS ---
-    if force_agent:
-        plan = plan_route(q)
-        route = "tool"  # force tool mode branch consideration
-        tool  = plan.get("tool", None)
-        args  = plan.get("args", {}) if isinstance(plan.get("args"), dict) else {}
-        conf  = 1.0
-    else:
-        plan = plan_route(q)
-        route = str(plan.get("route", "")).lower()
-        tool  = plan.get("tool", None)
-        args  = plan.get("args", {}) if isinstance(plan.get("args"), dict) else {}
+        _note(info, "sentinel_chat")
+        with lmtrace.span("sentinel", mode="chat"):
+            return llm(_messages(CHAT_SYSTEM, q), temperature=0.3, max_tokens=600, on_token=on_token).strip()
+
+    # --- FAST PATH: unambiguous prompts skip the planner ---
+    action, fast_conf = fast_route(q)
+    if action is not None and fast_conf >= FAST_ROUTE_THRESHOLD:
+        _note(info, "fast", action["tool"])
+        return _run_action(action)
+
+    # --- NATIVE TOOL CALLING: one call either calls a tool or answers ---
+    if NATIVE_TOOLS:
+        reply = llm_tools(_messages(CHAT_SYSTEM, q), tool_choice="required" if force_agent else "auto")
+        route, action, final = _native_outcome(reply, q, force_agent)
+        _note(info, route, action["tool"] if action is not None else None)
+        return _run_action(action) if action is not None else final
+
+    # --- SINGLE-CALL ROUTE + ANSWER ---
+    if SINGLE_CALL_ROUTING:
+        raw = llm(_messages(ROUTE_ANSWER_SYSTEM, q), temperature=0.3, max_tokens=600, stage="route_answer")
+        route, action, final = _single_call_outcome(raw, q, force_agent)
+        _note(info, route, action["tool"] if action is not None else None)
+        return _run_action(action) if action is not None else final
+
+    # --- PLANNER PASS (optionally racing a speculative chat answer) ---
+    # Speculate only when the planner has to run: a cached tool plan would
+    # open a chat request just to abort it.
+    plan = _cached_plan(q)
+    spec = None
+    if plan is None:
+        spec = _SpeculativeChat(_messages(CHAT_SYSTEM, q)) if SPECULATIVE_CHAT and not force_agent else None
         try:
-            conf = float(plan.get("confidence", 0.0))
-        except Exception:
-            conf = 0.0
+            with lmtrace.span("plan_route"):
+                plan = _plan_from_llm(q)
+        except BaseException:
+            if spec is not None:
+                spec.cancel()
+            raise
+    route, tool, args, conf = _plan_fields(plan, force_agent)
+    confident_chat = route == "chat" and conf >= PLAN_CONF_THRESHOLD and not force_agent
+    if spec is not None and not confident_chat:
+        spec.cancel()
 
     # Confident tool branch
-    if route == "tool" and (force_agent or conf >= PLAN_CONF_THRESHOLD) and (tool is None or valid_tool_choice(tool, args)):
-        # If planner proposed a specific tool with valid args, run it;
-        # otherwise fall back to heuristic inference to build the first action.
-        if tool and valid_tool_choice(tool, args):
-            fn = TOOLS.get(tool)
-            if not fn:
-                return f"ERROR: unknown tool '{tool}'"
-            result = fn(args)
-            return result if tool == "read_file" else f"[TOOL RESULT] {result}"
-        else:
-            # Heuristic to decide first tool action (e.g., read_file on path, calc on expr)
-            data = autowrap_to_action("", q)
-            if "tool" in data:
-                t = data["tool"]
-                a = data.get("args", {})
-                fn = TOOLS.get(t)
-                if not fn:
-                    return f"ERROR: unknown tool '{t}'"
-                res = fn(a)
-                return res if t == "read_file" else f"[TOOL RESULT] {res}"
+    action = _confident_tool_action(route, tool, args, conf, force_agent, q)
+    if action is not None:
+        _note(info, "tool", action["tool"])
+        return _run_action(action)
 
     # Confident chat
-    if route == "chat" and conf >= PLAN_CONF_THRESHOLD and not force_agent:
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": q},
-        ]
-        return llm(messages, temperature=0.3, max_tokens=600).strip()
+    if confident_chat:
+        _note(info, "chat")
+        if spec is not None:
+            return spec.claim(on_token).strip()
+        return llm(_messages(CHAT_SYSTEM, q), temperature=0.3, max_tokens=600, on_token=on_token).strip()
 
     # --- FALLBACK: one normal call, then autowrap ---
-    messages = [
-        {"role": "system", "content": "You are an assistant. Respond naturally."},
-        {"role": "user", "content": q},
-    ]
-    raw = llm(messages, temperature=0.3, max_tokens=500)
-    data = autowrap_to_action(raw, q)
-
-    if "tool" in data:
-        t = data["tool"]
-        a = data.get("args", {})
-        fn = TOOLS.get(t)
-        if not fn:
-            return f"ERROR: unknown tool '{t}'"
-        res = fn(a)
-        return res if t == "read_file" else f"[TOOL RESULT] {res}"
+    with lmtrace.span("fallback"):
+        # Only stream when the prompt alone won't be turned into a tool action
+        hint = _prompt_action(q)
+        raw = llm(_messages(FALLBACK_SYSTEM, q), temperature=0.3, max_tokens=500,
+                  on_token=on_token if hint is None else None, stage="fallback")
+        action, final = _fallback_result(raw, q, hint)
+        _note(info, "fallback", action["tool"] if action is not None else None)
+        return _run_action(action) if action is not None else final
+
+@lmtrace.traced("run_query")
+async def run_query_async(user_input: str, on_token: Optional[Callable[[str], None]] = None,
+                          info: Optional[Dict[str, Any]] = None) -> str:
+    """run_query() on the shared AsyncOpenAI client; safe to run many concurrently.
+
+    The routing heuristics probe and read files, so like the tools they run
+    in worker threads rather than on the event loop.
+    """
+    q = user_input.strip()
 
-    if "final" in data:
-        return data["final"]
+    direct = await asyncio.to_thread(handle_direct_command, q)
+    if direct is not None:
+        _note(info, "direct", _direct_tool(q))
+        return direct
 
-    return "ERROR: no valid result"
+    force_agent = False
+    if q.startswith(SENTINEL_AGENT):
+        force_agent = True
+        q = q[len(SENTINEL_AGENT):].lstrip()
+        lmtrace.instant("sentinel", mode="agent")
+    elif q.startswith(SENTINEL_CHAT):
+        _note(info, "sentinel_chat")
+        with lmtrace.span("sentinel", mode="chat"):
+            return (await llm_async(_messages(CHAT_SYSTEM, q), temperature=0.3, max_tokens=600,
+                                    on_token=on_token)).strip()
+
+    action, fast_conf = await asyncio.to_thread(fast_route, q)
+    if action is not None and fast_conf >= FAST_ROUTE_THRESHOLD:
+        _note(info, "fast", action["tool"])
+        return await _run_action_async(action)
+
+    if NATIVE_TOOLS:
+        reply = await llm_tools_async(_messages(CHAT_SYSTEM, q), tool_choice="required" if force_agent else "auto")
+        route, action, final = await asyncio.to_thread(_native_outcome, reply, q, force_agent)
+        _note(info, route, action["tool"] if action is not None else None)
+        return await _run_action_async(action) if action is not None else final
+
+    if SINGLE_CALL_ROUTING:
+        raw = await llm_async(_messages(ROUTE_ANSWER_SYSTEM, q), temperature=0.3, max_tokens=600, stage="route_answer")
+        route, action, final = await asyncio.to_thread(_single_call_outcome, raw, q, force_agent)
+        _note(info, route, action["tool"] if action is not None else None)
+        return await _run_action_async(action) if action is not None else final
+
+    plan = _cached_plan(q)
+    spec = None
+    if plan is None:
+        spec = _SpeculativeChatAsync(_messages(CHAT_SYSTEM, q)) if SPECULATIVE_CHAT and not force_agent else None
+        try:
+            with lmtrace.span("plan_route"):
+                plan = await _plan_from_llm_async(q)
+        except BaseException:
+            if spec is not None:
+                spec.cancel()
+            raise
+    route, tool, args, conf = _plan_fields(plan, force_agent)
+    confident_chat = route == "chat" and conf >= PLAN_CONF_THRESHOLD and not force_agent
+    if spec is not None and not confident_chat:
+        spec.cancel()
+
+    action = await asyncio.to_thread(_confident_tool_action, route, tool, args, conf, force_agent, q)
+    if action is not None:
+        _note(info, "tool", action["tool"])
+        return await _run_action_async(action)
+
+    if confident_chat:
+        _note(info, "chat")
+        if spec is not None:
+            return (await spec.claim(on_token)).strip()
+        return (await llm_async(_messages(CHAT_SYSTEM, q), temperature=0.3, max_tokens=600, on_token=on_token)).strip()
+
+    with lmtrace.span("fallback"):
+        hint = await asyncio.to_thread(_prompt_action, q)
+        raw = await llm_async(_messages(FALLBACK_SYSTEM, q), temperature=0.3, max_tokens=500,
+                              on_token=on_token if hint is None else None, stage="fallback")
+        action, final = await asyncio.to_thread(_fallback_result, raw, q, hint)
+        _note(info, "fallback", action["tool"] if action is not None else None)
+        return await _run_action_async(action) if action is not None else final
 
 # -----------------------------------------------------------
 # MAIN LOOP
@@ -325,4 +988,18 @@ if __name__ == "__main__":
             break
         if q.lower() in {"exit", "quit"}:
             break
-        print("AI >", run_query(q))
+        streamed: list[str] = []
+        def show(delta: str) -> None:
+            if not streamed:
+                print("AI > ", end="", flush=True)
+            streamed.append(delta)
+            print(delta, end="", flush=True)
+        out = run_query(q, on_token=show)
+        if streamed:
+            st = last_call_stats()
+            ttft = f"{st['ttft']:.2f}s" if st.get("ttft") is not None else "-"
+            print(f"\n   (ttft {ttft}, {st.get('tok_per_s', 0.0):.1f} tok/s)")
+            if not "".join(streamed).strip().startswith(out.strip()):
+                print("AI >", out)
+        else:
+            print("AI >", out)
@@ -0,0 +1,95 @@
+"""Run a JSONL file of prompts through agent.run_query with bounded concurrency.
+
+    python batch.py prompts.jsonl -o results.jsonl -j 8
+    cat prompts.jsonl | python batch.py - > results.jsonl
+
+Each input line is either a JSON string or an object with a "prompt" key
+(an optional "id" is copied through). Output lines come back in input order
+with the answer, route taken, tool used and per-item latency.
+"""
+from __future__ import annotations
+import argparse, asyncio, json, sys, time
+from typing import Any, Dict, List, TextIO
+
+import agent
+
+
+def read_prompts(fh: TextIO) -> List[Dict[str, Any]]:
+    items = []
+    for n, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line:
+            continue
+        obj = json.loads(line)
+        if isinstance(obj, str):
+            obj = {"prompt": obj}
+        if not isinstance(obj, dict) or not isinstance(obj.get("prompt"), str):
+            raise ValueError(f"line {n}: expected a string or an object with a 'prompt' string")
+        items.append(obj)
+    return items
+
+
+async def run_one(index: int, item: Dict[str, Any], sem: asyncio.Semaphore) -> Dict[str, Any]:
+    info: Dict[str, Any] = {}
+    row: Dict[str, Any] = {"index": index}
+    if "id" in item:
+        row["id"] = item["id"]
+    row["prompt"] = item["prompt"]
+    async with sem:
+        t0 = time.perf_counter()
+        try:
+            row["output"] = await agent.run_query_async(item["prompt"], info=info)
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+        row["latency_s"] = round(time.perf_counter() - t0, 4)
+    row["route"] = info.get("route")
+    row["tool"] = info.get("tool")
+    return row
+
+
+async def run_batch(items: List[Dict[str, Any]], out: TextIO, concurrency: int) -> List[Dict[str, Any]]:
+    """Run all items, writing each row as soon as every earlier row is written."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+    tasks = [asyncio.create_task(run_one(i, it, sem)) for i, it in enumerate(items)]
+    rows: List[Dict[str, Any]] = []
+    for task in tasks:
+        row = await task
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        out.flush()
+        rows.append(row)
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("input", help="JSONL file of prompts, or - for stdin")
+    ap.add_argument("-o", "--output", default="-", help="output JSONL (default: stdout)")
+    ap.add_argument("-j", "--concurrency", type=int, default=4, help="requests in flight (default: 4)")
+    a = ap.parse_args(argv)
+
+    agent.STREAM = False   # nobody watches tokens in batch mode
+    if a.input == "-":
+        items = read_prompts(sys.stdin)
+    else:
+        with open(a.input, "r", encoding="utf-8") as f:
+            items = read_prompts(f)
+
+    out = sys.stdout if a.output == "-" else open(a.output, "w", encoding="utf-8")
+    t0 = time.perf_counter()
+    try:
+        rows = asyncio.run(run_batch(items, out, a.concurrency))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    wall = time.perf_counter() - t0
+
+    lat = sorted(r["latency_s"] for r in rows)
+    errors = sum(1 for r in rows if "error" in r)
+    p50 = lat[len(lat) // 2] if lat else 0.0
+    print(f"[batch] {len(rows)} prompts, {errors} errors, wall {wall:.2f}s, "
+          f"p50 {p50:.2f}s, concurrency {a.concurrency}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""End-to-end latency benchmarks for agent.run_query and tools_loop.run_query.
+
+    python bench.py                                   # every scenario, 20 runs each
+    python bench.py -n 50 --ttft 0.05 --tok-per-s 200 --only planner_tool,loop
+    python bench.py --json before.json                # save a baseline ...
+    python bench.py --compare before.json             # ... and diff against it later
+    python bench.py --startup                         # cold-start time of one-shot commands
+
+Each scenario drives one path through the agents against an in-process
+mock_lmstudio server, so the numbers are the agents' own overhead plus the
+simulated model timing (--latency / --ttft / --tok-per-s). Response and plan
+caches are cleared before every query unless --cache is given. LLM calls and
+prompt tokens per query are counted from the requests the mock server saw.
+
+--startup instead times fresh interpreters running a one-shot direct command,
+the way scripts call the agent, with and without building the LLM client.
+"""
+from __future__ import annotations
+import argparse, contextlib, io, json, os, statistics, subprocess, sys, tempfile, time
+from typing import Any, Callable, Dict, List, Optional
+
+import agent
+import lmclient
+import tools_loop
+from mock_lmstudio import MockServer, prompt_tokens
+
+
+# ----------------------------------------------------------------------------
+# Scripted model behaviour per scenario (body -> reply)
+# ----------------------------------------------------------------------------
+def _system(body: Dict[str, Any]) -> str:
+    msgs = body.get("messages") or []
+    return msgs[0].get("content", "") if msgs and msgs[0].get("role") == "system" else ""
+
+def _tool_results(body: Dict[str, Any]) -> int:
+    return sum(1 for m in body.get("messages") or []
+               if m.get("role") == "tool" or str(m.get("content", "")).startswith("TOOL_RESULT:"))
+
+def _agent_model(plan: Dict[str, Any], answer: str) -> Callable[[Dict[str, Any]], str]:
+    """Planner calls get `plan`, every other call gets `answer`."""
+    def reply(body):
+        return json.dumps(plan) if _system(body) == agent.PLANNER_SYSTEM else answer
+    return reply
+
+def _loop_model(steps: List[Dict[str, Any]]) -> Callable[[Dict[str, Any]], str]:
+    """tools_loop step k (k tool results so far) gets steps[k]."""
+    def reply(body):
+        return json.dumps(steps[min(_tool_results(body), len(steps) - 1)])
+    return reply
+
+CHAT_ANSWER = ("Compilers translate source code into machine code in several passes: "
+               "lexing, parsing, analysis, optimisation and code generation.")
+
+# (name, module, prompt, model)
+SCENARIOS = [
+    ("direct",          agent, "!calc (3+4)*2", None),
+    ("sentinel_chat",   agent, "<|chat|> tell me about compilers", _agent_model({}, CHAT_ANSWER)),
+    ("fast_route",      agent, "what is 17+5", None),
+    ("planner_tool",    agent, "how much is seventeen plus five",
+     _agent_model({"route": "tool", "tool": "calc", "args": {"expr": "17+5"}, "confidence": 0.95}, "")),
+    ("planner_chat",    agent, "tell me about compilers",
+     _agent_model({"route": "chat", "tool": None, "args": {}, "confidence": 0.95}, CHAT_ANSWER)),
+    ("fallback",        agent, "hmm, compilers?",
+     _agent_model({"route": "chat", "tool": None, "args": {}, "confidence": 0.3}, CHAT_ANSWER)),
+    ("deterministic",   tools_loop, "what is in notes.txt", None),
+    ("bootstrap",       tools_loop, "summarize the file notes.txt",
+     _loop_model([{"final": "bootstrap did not run"}, {"final": "The notes say 34."}])),
+    ("loop",            tools_loop, "add 1 and 2, then double the result",
+     _loop_model([{"tool": "calc", "args": {"expr": "1+2"}},
+                  {"tool": "calc", "args": {"expr": "3*2"}},
+                  {"final": "6"}])),
+]
+
+
+# ----------------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------------
+def _pct(sorted_vals: List[float], p: float) -> float:
+    # nearest rank
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def _clear_caches(keep: bool) -> None:
+    if keep:
+        return
+    agent.PLAN_CACHE.clear()
+    agent.RESPONSE_CACHE.clear()
+    tools_loop.RESPONSE_CACHE.clear()
+
+def run_scenario(srv: MockServer, module, prompt: str, model, n: int, keep_cache: bool) -> Dict[str, Any]:
+    srv.responder = model or (lambda body: "unexpected LLM call")
+    lat: List[float] = []
+    calls = 0
+    tokens = 0
+    for i in range(n + 1):          # first run warms up and is not counted
+        _clear_caches(keep_cache)
+        srv.reset()
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            module.run_query(prompt)
+            dt = time.perf_counter() - t0
+        if i == 0:
+            continue
+        lat.append(dt)
+        calls += len(srv.requests)
+        tokens += sum(prompt_tokens(b.get("messages")) for b in srv.requests)
+    lat.sort()
+    return {
+        "n": n,
+        "p50_ms": round(_pct(lat, 50) * 1e3, 3),
+        "p95_ms": round(_pct(lat, 95) * 1e3, 3),
+        "llm_calls": round(calls / n, 2),
+        "prompt_tokens": round(tokens / n, 1),
+    }
+
+def _point_agents_at(srv: MockServer) -> None:
+    for mod in (agent, tools_loop):
+        mod.LM = lmclient.client(srv.base_url)
+        mod.ALM = lmclient.LazyClient(srv.base_url, asynchronous=True)   # per event loop
+
+def print_table(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> None:
+    head = f"{'scenario':16s} {'n':>4s} {'p50 ms':>9s} {'p95 ms':>9s} {'LLM calls':>10s} {'prompt tok':>11s}"
+    print(head + ("  vs baseline p50" if baseline else ""))
+    for name, r in results.items():
+        line = (f"{name:16s} {r['n']:4d} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} "
+                f"{r['llm_calls']:10.2f} {r['prompt_tokens']:11.1f}")
+        old = (baseline or {}).get(name)
+        if old and old["p50_ms"]:
+            line += f"  {100.0 * (r['p50_ms'] - old['p50_ms']) / old['p50_ms']:+7.1f}%"
+        print(line)
+
+# ----------------------------------------------------------------------------
+# Startup time
+# ----------------------------------------------------------------------------
+STARTUP_CASES = [
+    ("interpreter",       "pass"),
+    ("direct command",    "import agent; agent.handle_direct_command('!calc 1+2')"),
+    ("+ build LLM client", "import agent; agent.handle_direct_command('!calc 1+2'); agent.LM.chat"),
+]
+
+def run_startup(n: int) -> Dict[str, Dict[str, Any]]:
+    here = os.path.dirname(os.path.abspath(__file__))
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, code in STARTUP_CASES:
+        probe = code + "; import sys; print('openai' in sys.modules)"
+        times = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, check=True)
+            times.append(time.perf_counter() - t0)
+        results[name] = {
+            "n": n,
+            "median_ms": round(statistics.median(times) * 1e3, 1),
+            "min_ms": round(min(times) * 1e3, 1),
+            "imports_openai": out.stdout.strip().endswith("True"),
+        }
+    return results
+
+def print_startup(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'startup':20s} {'n':>4s} {'median ms':>10s} {'min ms':>8s}  openai imported")
+    for name, r in results.items():
+        print(f"{name:20s} {r['n']:4d} {r['median_ms']:10.1f} {r['min_ms']:8.1f}  {r['imports_openai']}")
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", type=int, default=20, help="timed runs per scenario (default: 20)")
+    ap.add_argument("--only", help="comma-separated scenario names")
+    ap.add_argument("--latency", type=float, default=0.0, help="mock server delay before each response (s)")
+    ap.add_argument("--ttft", type=float, default=0.02, help="mock time to first token (s, default 0.02)")
+    ap.add_argument("--tok-per-s", type=float, default=0.0, help="mock decode rate (0 = instant)")
+    ap.add_argument("--no-stream", action="store_true", help="use non-streamed completions")
+    ap.add_argument("--cache", action="store_true", help="keep response / plan caches between runs")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="baseline JSON from an earlier --json run")
+    ap.add_argument("--startup", action="store_true", help="measure cold start of one-shot direct commands")
+    a = ap.parse_args(argv)
+
+    if a.startup:
+        startup = run_startup(a.n)
+        print_startup(startup)
+        if a.json:
+            with open(a.json, "w", encoding="utf-8") as f:
+                json.dump({"startup": startup}, f, indent=2)
+        return 0
+
+    only = set(a.only.split(",")) if a.only else None
+    unknown = (only or set()) - {s[0] for s in SCENARIOS}
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    agent.STREAM = tools_loop.STREAM = not a.no_stream
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as root, \
+            MockServer(latency=a.latency, ttft=a.ttft, tok_per_s=a.tok_per_s) as srv:
+        with open(os.path.join(root, "notes.txt"), "w", encoding="utf-8") as f:
+            f.write("34\n")
+        agent.ROOT = tools_loop.ROOT = root
+        _point_agents_at(srv)
+        for name, module, prompt, model in SCENARIOS:
+            if only and name not in only:
+                continue
+            results[name] = run_scenario(srv, module, prompt, model, a.n, a.cache)
+
+    baseline = None
+    if a.compare:
+        with open(a.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+    if a.json:
+        config = {k: getattr(a, k) for k in ("n", "latency", "ttft", "tok_per_s", "no_stream", "cache")}
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+r"""File indexes of a project root: DirIndex (which files exist) and
+SearchIndex (an inverted index of their words, for search_files).
+
+    fileindex.dir_index_for(ROOT).has("notes.txt")
+
+    idx = fileindex.index_for(ROOT)
+    idx.search("plan cache")            # lines containing every word
+    idx.search(r"def \w+_async", regex=True)
+
+Each file's distinct word tokens are indexed; a search refreshes the index at
+most every `ttl` seconds, statting the tree and re-reading only files whose
+(size, mtime_ns) changed. Keyword queries read only the files that contain
+every query word and return the lines holding all of them (or, if there are
+none, lines from the files holding any of them); regex queries scan all
+indexed files. After writing a file, call changed(root, path). Binary files,
+files over max_file_bytes and IGNORE_DIRS are skipped.
+
+DirIndex answers "is this a file under ROOT" and "where is a file with this
+name" from memory. After one bounded walk, a lookup stats only the directory
+it falls in (relisting it if its mtime changed), so the prompt heuristics
+cost about one stat per token however large the tree is.
+"""
+from __future__ import annotations
+import os, re, sys, threading, time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+IGNORE_DIRS = {".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv", ".mypy_cache",
+               ".pytest_cache", ".idea", ".vscode"}
+_WORD_RE = re.compile(r"[A-Za-z0-9_]{2,}")
+
+
+def words(text: str) -> Set[str]:
+    return {w.lower() for w in _WORD_RE.findall(text)}
+
+
+def walk_files(root: str, ignore_dirs=IGNORE_DIRS) -> Iterator[Tuple[str, os.stat_result]]:
+    """(path relative to root, stat) for every regular file under root, skipping ignored dirs."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        if e.name not in ignore_dirs and not e.name.startswith("."):
+                            stack.append(e.path)
+                    elif e.is_file():
+                        yield os.path.relpath(e.path, root), e.stat()
+                except OSError:
+                    continue
+
+
+class DirIndex:
+    """Cached set of file paths under root plus basename -> paths.
+
+    The tree is walked once (bounded by max_files / max_dirs). After that
+    has() stats only the directory holding the looked-up path and relists it
+    if its mtime changed, so a lookup costs about one stat however big the
+    tree is. find() re-walks at most every `ttl` seconds, statting each
+    directory and relisting only the changed ones.
+
+    Directories that are not walked (IGNORE_DIRS, dot-dirs, symlinks, new
+    directories, or anything past the bounds) are remembered, and has()
+    answers paths under them with os.path.isfile, so it never says no where
+    the filesystem would say yes. On case-insensitive filesystems lookups
+    ignore case too. Call invalidate(path) after creating a file.
+    """
+
+    def __init__(self, root: str, max_files: int = 50000, max_dirs: int = 5000, ttl: float = 1.0) -> None:
+        self.root = os.path.abspath(root)
+        self.max_files = max_files
+        self.max_dirs = max_dirs
+        self.ttl = ttl
+        self.complete = True
+        self.rescans = 0               # directories listed so far
+        # rel dir -> (mtime_ns, files, subdirs walked, subdirs skipped); mtime None = relist on next use
+        self._dirs: Dict[str, Tuple[Optional[int], List[str], List[str], List[str]]] = {}
+        self._dir_keys: Dict[str, str] = {}   # _key(rel dir) -> rel dir
+        self._paths: Set[str] = set()
+        self._by_name: Dict[str, List[str]] = {}
+        self._opaque: Set[str] = set()  # dirs not walked; their files are looked up on disk
+        self._fold: Optional[bool] = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def _key(self, rel: str) -> str:
+        return rel.lower() if self._fold else rel
+
+    def _case_insensitive(self) -> bool:
+        swapped = self.root.swapcase()
+        if swapped == self.root:
+            return sys.platform in ("win32", "darwin")
+        try:
+            return os.path.samefile(self.root, swapped)
+        except OSError:
+            return False
+
+    def _list(self, rel: str) -> Tuple[List[str], List[str], List[str]]:
+        files: List[str] = []
+        subdirs: List[str] = []
+        skipped: List[str] = []
+        try:
+            with os.scandir(os.path.join(self.root, rel)) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            walk = e.name not in IGNORE_DIRS and not e.name.startswith(".")
+                            (subdirs if walk else skipped).append(os.path.join(rel, e.name))
+                        elif e.is_file():
+                            files.append(os.path.join(rel, e.name))
+                        elif e.is_dir():       # symlink to a directory
+                            skipped.append(os.path.join(rel, e.name))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        self.rescans += 1
+        return files, subdirs, skipped
+
+    def _add_files(self, files: List[str]) -> None:
+        for f in files:
+            self._paths.add(self._key(f))
+            self._by_name.setdefault(self._key(os.path.basename(f)), []).append(f)
+
+    def refresh(self, force: bool = False) -> None:
+        """Walk the tree, relisting only directories whose mtime changed."""
+        if not force and time.monotonic() - self._checked < self.ttl:
+            return
+        with self._lock:
+            if self._fold is None:
+                self._fold = self._case_insensitive()
+            old_dirs = self._dirs
+            self._dirs, self._dir_keys, self._paths, self._by_name, self._opaque = {}, {}, set(), {}, set()
+            complete = True
+            stack = [""]
+            while stack:
+                if len(self._paths) >= self.max_files or len(self._dirs) >= self.max_dirs:
+                    self._opaque.update(self._key(d) for d in stack)   # stop descending
+                    complete = False
+                    break
+                rel = stack.pop()
+                try:
+                    mtime = os.stat(os.path.join(self.root, rel)).st_mtime_ns
+                except OSError:
+                    continue
+                old = old_dirs.get(rel)
+                entry = old if old is not None and old[0] == mtime else (mtime,) + self._list(rel)
+                self._dirs[rel] = entry
+                self._dir_keys[self._key(rel)] = rel
+                _, files, subdirs, skipped = entry
+                self._opaque.update(self._key(d) for d in skipped)
+                room = self.max_files - len(self._paths)
+                if len(files) > room:          # only part of this directory fits
+                    self._opaque.add(self._key(rel))
+                    complete = False
+                self._add_files(files[:room])
+                stack.extend(subdirs)
+            self.complete = complete
+            self._checked = time.monotonic()
+
+    def _relist(self, rel: str, mtime: int) -> None:
+        """Replace rel's files (a walked directory whose mtime changed); caller holds the lock."""
+        _, old_files, _, _ = self._dirs[rel]
+        gone = set(old_files)
+        for f in old_files:
+            self._paths.discard(self._key(f))
+        for name in {self._key(os.path.basename(f)) for f in old_files}:
+            kept = [f for f in self._by_name.get(name, ()) if f not in gone]
+            if kept:
+                self._by_name[name] = kept
+            else:
+                self._by_name.pop(name, None)
+        files, subdirs, skipped = self._list(rel)
+        self._dirs[rel] = (mtime, files, subdirs, skipped)
+        self._opaque.update(self._key(d) for d in skipped)
+        if len(self._paths) + len(files) > self.max_files:
+            self._opaque.add(self._key(rel))
+            self.complete = False
+        else:
+            self._add_files(files)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Relist path's directory (no path: walk the whole tree) on next use, whatever its mtime."""
+        with self._lock:
+            if path is None:
+                self._dirs.clear()
+                self._dir_keys.clear()
+            else:
+                rel = os.path.relpath(os.path.dirname(os.path.abspath(os.path.join(self.root, path))), self.root)
+                d = self._dir_keys.get(self._key("" if rel == "." else rel))
+                if d is not None:
+                    self._dirs[d] = (None,) + self._dirs[d][1:]
+            self._checked = float("-inf")
+
+    def has(self, path: str) -> bool:
+        """Like os.path.isfile(os.path.join(root, path)), from the index when possible."""
+        rel = os.path.normpath(path)
+        if os.path.isabs(rel) or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return os.path.isfile(os.path.join(self.root, path))
+        if not self._dirs:
+            self.refresh(force=True)
+        parent = self._key(os.path.dirname(rel))
+        with self._lock:
+            d = self._dir_keys.get(parent)
+            if d is not None and parent not in self._opaque:
+                try:
+                    mtime = os.stat(os.path.join(self.root, d)).st_mtime_ns
+                except OSError:
+                    return False
+                if mtime != self._dirs[d][0]:
+                    self._relist(d, mtime)
+                if parent not in self._opaque:   # _relist may have run out of room
+                    return self._key(rel) in self._paths
+        return os.path.isfile(os.path.join(self.root, rel))
+
+    def find(self, name: str) -> List[str]:
+        """Paths (relative to root) of walked files whose basename is name."""
+        self.refresh()
+        return list(self._by_name.get(self._key(name), ()))
+
+
+class Hit(NamedTuple):
+    path: str
+    line: int
+    snippet: str
+
+
+class SearchIndex:
+    """Word -> files index of one root, refreshed incrementally by (size, mtime_ns)."""
+
+    def __init__(self, root: str, max_file_bytes: int = 1024 * 1024, max_files: int = 20000,
+                 ttl: float = 1.0) -> None:
+        self.root = os.path.abspath(root)
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.ttl = ttl
+        self.reindexed = 0             # files (re)read so far
+        self._files: Dict[str, Tuple[Tuple[int, int], Set[str]]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def _read(self, rel: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, rel), "rb") as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes or b"\0" in data[:8192]:
+            return None
+        return data.decode("utf-8", errors="ignore")
+
+    def _remove(self, rel: str) -> None:
+        _, toks = self._files.pop(rel)
+        for t in toks:
+            paths = self._postings.get(t)
+            if paths is not None:
+                paths.discard(rel)
+                if not paths:
+                    del self._postings[t]
+
+    def refresh(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._checked < self.ttl:
+            return
+        with self._lock:
+            seen = set()
+            for rel, st in walk_files(self.root):
+                if len(seen) >= self.max_files:
+                    break
+                if st.st_size > self.max_file_bytes:
+                    continue
+                seen.add(rel)
+                stamp = (st.st_size, st.st_mtime_ns)
+                old = self._files.get(rel)
+                if old is not None and old[0] == stamp:
+                    continue
+                if old is not None:
+                    self._remove(rel)
+                text = self._read(rel)
+                toks = words(text) if text is not None else set()
+                self._files[rel] = (stamp, toks)
+                for t in toks:
+                    self._postings.setdefault(t, set()).add(rel)
+                self.reindexed += 1
+            for rel in [r for r in self._files if r not in seen]:
+                self._remove(rel)
+            self._checked = time.monotonic()
+
+    def invalidate(self) -> None:
+        self._checked = float("-inf")
+
+    def candidates(self, terms: Set[str], every: bool = True) -> List[str]:
+        """Files containing every term (or, every=False, any of them); no terms: all text files."""
+        with self._lock:
+            if not terms:
+                return sorted(r for r, (_, toks) in self._files.items() if toks)
+            sets = [self._postings.get(t, set()) for t in terms]
+            if every:
+                return sorted(set.intersection(*sorted(sets, key=len)))
+            return sorted(set().union(*sets))
+
+    def search(self, query: str, regex: bool = False, max_hits: int = 20) -> List[Hit]:
+        """Lines matching query: every word of it (case-insensitive), or the regex."""
+        self.refresh()
+        if regex:
+            terms: Set[str] = set()
+            passes = [(True, re.compile(query, re.IGNORECASE).search)]
+        else:
+            terms = words(query)
+            if not terms:
+                return []
+            # lines with every word; failing that, lines with any of them (from any file holding one)
+            passes = [(True, lambda line: terms <= words(line)), (False, lambda line: bool(terms & words(line)))]
+        for every, match in passes:
+            hits: List[Hit] = []
+            for rel in self.candidates(terms, every):
+                text = self._read(rel)
+                if text is None:
+                    continue
+                for n, line in enumerate(text.splitlines(), 1):
+                    if match(line):
+                        hits.append(Hit(rel, n, line.strip()[:160]))
+                        if len(hits) >= max_hits:
+                            return hits
+            if hits:
+                return hits
+        return []
+
+    def stats(self) -> Dict[str, int]:
+        return {"files": len(self._files), "words": len(self._postings), "reindexed": self.reindexed}
+
+
+_indexes: Dict[str, SearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for(root: str) -> SearchIndex:
+    """The shared SearchIndex of root (one per process, built lazily)."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        idx = _indexes.get(root)
+        if idx is None:
+            idx = _indexes[root] = SearchIndex(root)
+        return idx
+
+
+_dir_indexes: Dict[str, DirIndex] = {}
+
+
+def dir_index_for(root: str) -> DirIndex:
+    """The shared DirIndex of root (one per process, built lazily)."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        idx = _dir_indexes.get(root)
+        if idx is None:
+            idx = _dir_indexes[root] = DirIndex(root)
+        return idx
+
+
+def changed(root: str, path: str) -> None:
+    """Tell root's shared indexes that path was written."""
+    dir_index_for(root).invalidate(path)
+    index_for(root).invalidate()
+
+
+def format_hits(hits: List[Hit], max_hits: int) -> str:
+    """Tool output: one "path:line: snippet" per hit."""
+    if not hits:
+        return "no matches"
+    files = len({h.path for h in hits})
+    more = " (limit reached)" if len(hits) >= max_hits else ""
+    return "\n".join(f"{h.path}:{h.line}: {h.snippet}" for h in hits) + \
+        f"\n[{len(hits)} hits in {files} files{more}]"
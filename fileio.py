@@ -0,0 +1,311 @@
+"""Bounded file reads for the agents' read_file tools.
+
+Files are decoded in fixed-size blocks with an incremental UTF-8 decoder and
+reading stops as soon as enough characters are in hand, so memory stays flat
+however large the file is and a multi-byte character is never split. Line
+endings are translated to "\n" as text-mode open() does. Besides
+the head of a file, read_window() serves a byte range, a line range or the
+last N lines (found by seeking backwards from EOF).
+
+cached_read() puts a process-wide LRU cache (CACHE) in front of read_window():
+entries are keyed on the path and window and only served while the file's
+(size, mtime_ns) still match, so repeat reads of unchanged files skip the disk.
+"""
+from __future__ import annotations
+import codecs, io, os, re, threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+BLOCK = 64 * 1024
+
+# Optional read_file arguments selecting part of a file
+WINDOW_ARGS = ("offset", "length", "start_line", "end_line", "tail")
+
+# A line break as the newline-translating decoder sees it
+_EOL_RE = re.compile(rb"\r\n?|\n")
+
+
+def _decoder() -> io.IncrementalNewlineDecoder:
+    """Incremental UTF-8 decoder (undecodable bytes dropped) that turns \r\n and \r into \n."""
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True)
+
+
+def _lf(text: str) -> str:
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class ReadResult(NamedTuple):
+    text: str
+    size: int          # total file size in bytes
+    truncated: bool    # the file (or requested window) has more text than was returned
+    span: str = ""     # which part was read, e.g. "bytes 100-900", "lines 10-20"; "" for the head
+
+
+def read_text(path: str, max_chars: int) -> ReadResult:
+    """First max_chars characters of a UTF-8 file (undecodable bytes are dropped)."""
+    size = os.path.getsize(path)
+    dec = _decoder()
+    parts = []
+    have = 0
+    with open(path, "rb") as f:
+        while have <= max_chars:          # one char past the limit tells us it truncated
+            block = f.read(BLOCK)
+            if not block:
+                parts.append(dec.decode(b"", final=True))
+                break
+            s = dec.decode(block)
+            parts.append(s)
+            have += len(s)
+    text = "".join(parts)
+    return ReadResult(text[:max_chars], size, len(text) > max_chars)
+
+
+def _skip_continuation(f) -> int:
+    """Move f past UTF-8 continuation bytes so decoding starts on a character; returns bytes skipped."""
+    start = f.tell()
+    head = f.read(4)
+    n = 0
+    while n < len(head) and n < 3 and (head[n] & 0xC0) == 0x80:
+        n += 1
+    f.seek(start + n)
+    return n
+
+
+def read_bytes(path: str, offset: int, length: Optional[int], max_chars: int) -> ReadResult:
+    """Text of the byte range [offset, offset+length), at most max_chars characters."""
+    size = os.path.getsize(path)
+    dec = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    parts = []
+    have = 0
+    with open(path, "rb") as f:
+        f.seek(min(offset, size))
+        start = f.tell() + _skip_continuation(f)
+        left = (size - start) if length is None else max(0, min(length, size - start))
+        while left > 0 and have <= max_chars:
+            block = f.read(min(BLOCK, left))
+            if not block:
+                break
+            left -= len(block)
+            s = dec.decode(block)     # a character cut by the window end is dropped
+            parts.append(s)
+            have += len(s)
+    text = "".join(parts)
+    truncated = len(text) > max_chars
+    text = text[:max_chars]
+    end = start + len(text.encode("utf-8"))
+    return ReadResult(_lf(text), size, truncated, f"bytes {start}-{end}")
+
+
+def read_lines(path: str, start: int, end: Optional[int], max_chars: int) -> ReadResult:
+    """Lines start..end (1-based, inclusive; end None = to EOF), at most max_chars characters."""
+    start = max(1, start)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        line, pos = 1, 0
+        cr = False                       # the last block ended in "\r", maybe half of a "\r\n"
+        while line < start:
+            block = f.read(BLOCK)
+            if not block:
+                return ReadResult("", size, False, f"line {start}")
+            i = 1 if cr and block[:1] == b"\n" else 0
+            cr = False
+            while line < start:
+                m = _EOL_RE.search(block, i)
+                if m is None:
+                    break
+                line, i = line + 1, m.end()
+                cr = i == len(block) and block[-1:] == b"\r"
+            if line == start:
+                f.seek(pos + i)
+                if cr and f.read(1) != b"\n":
+                    f.seek(pos + i)
+            pos += len(block)
+
+        want = None if end is None else max(0, end - start + 1)
+        dec = _decoder()
+        parts = []
+        have = newlines = 0
+        while have <= max_chars and (want is None or newlines < want):
+            block = f.read(BLOCK)
+            if not block:
+                parts.append(dec.decode(b"", final=True))
+                break
+            s = dec.decode(block)
+            parts.append(s)
+            have += len(s)
+            newlines += s.count("\n")
+    text = "".join(parts)
+    if want is not None:
+        cut = -1
+        for _ in range(want):
+            cut = text.find("\n", cut + 1)
+            if cut < 0:
+                break
+        if cut >= 0:
+            text = text[:cut + 1]
+    truncated = len(text) > max_chars
+    text = text[:max_chars]
+    if not text:
+        return ReadResult("", size, False, f"line {start}")
+    last = start + text.count("\n") - (1 if text.endswith("\n") else 0)
+    return ReadResult(text, size, truncated, f"lines {start}-{last}")
+
+
+def read_tail(path: str, n: int, max_chars: int) -> ReadResult:
+    """Last n lines, read backwards from EOF in blocks; at most max_chars (the end is kept)."""
+    size = os.path.getsize(path)
+    cap = max_chars * 4 + BLOCK          # enough bytes for max_chars characters
+    with open(path, "rb") as f:
+        pos = size
+        blocks = []
+        got = newlines = 0
+        while pos > 0 and newlines <= n and got < cap:
+            step = min(BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            newlines += block.count(b"\n") + block.count(b"\r") - block.count(b"\r\n")
+            if blocks and block[-1:] == b"\r" and blocks[-1][:1] == b"\n":
+                newlines -= 1            # a "\r\n" split between this block and the next
+            blocks.append(block)
+            got += len(block)
+    data = b"".join(reversed(blocks))
+    if pos > 0:                          # began mid-file: drop a partial leading character
+        k = 0
+        while k < min(3, len(data)) and (data[k] & 0xC0) == 0x80:
+            k += 1
+        data = data[k:]
+    # Split on "\n" only: str.splitlines() would also break at \x0b, \x0c, \x85, U+2028, ...
+    parts = _lf(data.decode("utf-8", errors="ignore")).split("\n")
+    found = [line + "\n" for line in parts[:-1]] + ([parts[-1]] if parts[-1] else [])
+    lines = found[-n:] if n > 0 else []
+    partial = pos > 0 and len(lines) == len(found) and len(lines) > 1
+    if partial:
+        lines = lines[1:]                # hit the byte cap: the first line starts before what was read
+    text = "".join(lines)
+    truncated = partial or len(text) > max_chars
+    text = text[-max_chars:]
+    return ReadResult(text, size, truncated, f"last {len(lines)} lines")
+
+
+def _int_arg(name: str, v: Any) -> Optional[int]:
+    if v is None or v == "":
+        return None
+    try:
+        n = int(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer, got {v!r}")
+    if n < 0:
+        raise ValueError(f"{name} must not be negative")
+    return n
+
+
+def read_window(path: str, max_chars: int, offset: Any = None, length: Any = None,
+                start_line: Any = None, end_line: Any = None, tail: Any = None) -> ReadResult:
+    """Dispatch read_file's optional arguments; with none of them, the head of the file."""
+    offset, length = _int_arg("offset", offset), _int_arg("length", length)
+    start_line, end_line = _int_arg("start_line", start_line), _int_arg("end_line", end_line)
+    tail = _int_arg("tail", tail)
+    modes = [offset is not None or length is not None,
+             start_line is not None or end_line is not None,
+             tail is not None]
+    if sum(modes) > 1:
+        raise ValueError("use only one of offset/length, start_line/end_line or tail")
+    if tail is not None:
+        return read_tail(path, tail, max_chars)
+    if modes[1]:
+        return read_lines(path, start_line or 1, end_line, max_chars)
+    if modes[0]:
+        return read_bytes(path, offset or 0, length, max_chars)
+    return read_text(path, max_chars)
+
+
+def render(res: ReadResult) -> str:
+    """Tool output: the text, plus a note on which part it is / what was left out."""
+    if res.span:
+        if not res.text:
+            return f"[nothing at {res.span}; the file is {res.size} bytes]"
+        cut = f", cut to {len(res.text)} chars" if res.truncated else ""
+        return f"{res.text}\n[{res.span} of a {res.size}-byte file{cut}]"
+    if not res.truncated:
+        return res.text
+    return f"{res.text}\n[truncated: showing the first {len(res.text)} chars of a {res.size}-byte file]"
+
+
+class FileCache:
+    """LRU cache of ReadResults, validated against (size, mtime_ns) on every lookup.
+
+    Keys are (absolute path, max_chars, window args); the total size of the
+    cached text is kept under max_bytes. Set enabled = False to bypass it.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, enabled: bool = True) -> None:
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # key -> ((size, mtime_ns), result, cost)
+        self._mem: "OrderedDict[tuple, Tuple[Tuple[int, int], ReadResult, int]]" = OrderedDict()
+
+    def get(self, key: tuple, stamp: Tuple[int, int]) -> Optional[ReadResult]:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None or entry[0] != stamp:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, stamp: Tuple[int, int], res: ReadResult) -> None:
+        cost = len(res.text) * 2 + 100   # rough in-memory size
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._mem:
+                self._drop(key)
+            self._mem[key] = (stamp, res, cost)
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._mem.popitem(last=False)[1][2]
+
+    def invalidate(self, path: str) -> None:
+        """Forget every window of path (call after writing it)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [k for k in self._mem if k[0] == path]:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._mem),
+                "bytes": self._bytes, "enabled": self.enabled}
+
+    def _drop(self, key: tuple) -> None:
+        self._bytes -= self._mem.pop(key)[2]
+
+
+CACHE = FileCache()
+
+
+def cached_read(path: str, max_chars: int, **window: Any) -> ReadResult:
+    """read_window() through CACHE."""
+    path = os.path.abspath(path)
+    if not CACHE.enabled:
+        return read_window(path, max_chars, **window)
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    key = (path, max_chars) + tuple(window.get(k) for k in WINDOW_ARGS)
+    res = CACHE.get(key, stamp)
+    if res is None:
+        res = read_window(path, max_chars, **window)
+        CACHE.put(key, stamp, res)
+    return res
@@ -0,0 +1,261 @@
+"""Scanning and repair of JSON objects in (streamed) model output."""
+from __future__ import annotations
+import json, re
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Longest run of a JSON string body with no closing quote (escapes honoured); a
+# lone trailing backslash is left for the next chunk
+_STR_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# Characters that matter inside an object once strings are skipped
+_STRUCT_RE = re.compile(r'[{}"]')
+
+
+class JsonObjectScanner:
+    """Find complete top-level {...} objects in text fed chunk by chunk.
+
+    Braces are only counted outside JSON strings (with escape handling), so a
+    "}" inside an argument value does not end the object early. Quotes in prose
+    around the objects are ignored. String bodies are skipped with a single
+    regex match, and feed() only scans the new chunk: an open string keeps its
+    escape state and the open object is kept as a list of chunks, so streaming
+    stays linear in the length of the output.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.pos = 0         # next index of self.text to scan
+        self.depth = 0
+        self.start = -1      # where the open object starts in self.text (< 0: in an earlier chunk)
+        self.in_str = False  # inside a string whose closing quote has not arrived
+        self.esc = False     # ... and the last character scanned was a backslash
+        self._open: List[str] = []  # feed(): the open object's text from earlier chunks
+        self._open_len = 0
+
+    def spans(self) -> List[Tuple[int, int]]:
+        """Advance over unscanned text; return (start, end) of objects closed in it."""
+        text = self.text
+        n = len(text)
+        pos = self.pos
+        out: List[Tuple[int, int]] = []
+        while pos < n:
+            if self.in_str:
+                if self.esc:
+                    pos += 1        # the escaped character
+                    self.esc = False
+                    continue
+                pos = _STR_BODY_RE.match(text, pos).end()
+                if pos == n:
+                    break           # string still open
+                if text[pos] == "\\":
+                    self.esc = True  # backslash is the last character so far
+                else:
+                    self.in_str = False
+                pos += 1
+            elif self.depth == 0:
+                i = text.find("{", pos)
+                if i < 0:
+                    pos = n
+                    break
+                self.start = i
+                self.depth = 1
+                pos = i + 1
+            else:
+                m = _STRUCT_RE.search(text, pos)
+                if m is None:
+                    pos = n
+                    break
+                i = m.start()
+                pos = i + 1
+                ch = text[i]
+                if ch == '"':
+                    self.in_str = True
+                elif ch == "{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        out.append((self.start, i + 1))
+                        self.start = -1
+        self.pos = pos
+        return out
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Add a chunk; return dicts whose closing brace arrived in it."""
+        self.text, self.pos = chunk, 0
+        if self.depth:
+            self.start = -self._open_len
+        found: List[Dict[str, Any]] = []
+        for a, b in self.spans():
+            if a < 0:               # began in an earlier chunk
+                body = "".join(self._open) + chunk[:b]
+                self._open, self._open_len = [], 0
+            else:
+                body = chunk[a:b]
+            try:
+                obj = json.loads(body)
+            except Exception:
+                continue
+            if isinstance(obj, dict):
+                found.append(obj)
+        if not self.depth:
+            self._open, self._open_len = [], 0
+        elif self.start >= 0:       # opened in this chunk
+            self._open, self._open_len = [chunk[self.start:]], len(chunk) - self.start
+        else:
+            self._open.append(chunk)
+            self._open_len += len(chunk)
+        self.text, self.pos = "", 0
+        return found
+
+
+def extract_last_json_dict(text: str) -> Optional[Dict[str, Any]]:
+    """Return the last top-level JSON object in text that parses as a dict.
+
+    One string-aware pass finds the top-level spans; they are then tried
+    from the end, so usually only one json.loads call is made.
+    """
+    if not text:
+        return None
+    sc = JsonObjectScanner()
+    sc.text = text
+    for a, b in reversed(sc.spans()):
+        try:
+            obj = json.loads(text[a:b])
+        except Exception:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return None
+
+
+_FENCE_RE = re.compile(r"```[A-Za-z0-9_-]*\s*\n?(.*?)(?:```|$)", re.DOTALL)
+_BARE_KEY_RE = re.compile(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)")
+_PY_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _fix_code(code: str) -> str:
+    code = _BARE_KEY_RE.sub(r'\1"\2"\3', code)
+    code = _PY_LITERAL_RE.sub(lambda m: _PY_LITERALS[m.group(1)], code)
+    return _TRAILING_COMMA_RE.sub(r"\1", code)
+
+
+def repair_json_dict(text: str) -> Optional[Dict[str, Any]]:
+    """Best-effort recovery of the first JSON object in sloppy model output.
+
+    Handles code fences, single-quoted strings, bare keys, Python
+    True/False/None, trailing commas and missing closing braces/brackets.
+    An unterminated string is not guessed at (the value was cut off), so
+    that case returns None.
+    """
+    if not text:
+        return None
+    fence = _FENCE_RE.search(text)
+    if fence and "{" in fence.group(1):
+        text = fence.group(1)
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    segs: List[str] = []      # alternating code / string pieces, strings already re-quoted
+    buf: List[str] = []
+    stack: List[str] = []
+    quote = None
+    i, n = start, len(text)
+    while i < n:
+        ch = text[i]
+        if quote is None:
+            if ch in "\"'":
+                segs.append(_fix_code("".join(buf)))
+                buf = ['"']
+                quote = ch
+            else:
+                buf.append(ch)
+                if ch in "{[":
+                    stack.append(_CLOSERS[ch])
+                elif ch in "}]" and stack:
+                    stack.pop()
+                    if not stack:
+                        break       # end of the top-level object; ignore trailing prose
+        elif ch == "\\":
+            nxt = text[i + 1:i + 2]
+            buf.append("'" if (quote == "'" and nxt == "'") else ch + nxt)
+            i += 2
+            continue
+        elif ch == quote:
+            buf.append('"')
+            segs.append("".join(buf))
+            buf = []
+            quote = None
+        elif ch == '"':
+            buf.append('\\"')       # double quote inside a single-quoted string
+        elif ch == "\n":
+            buf.append("\\n")
+        else:
+            buf.append(ch)
+        i += 1
+    if quote is not None:
+        return None
+    tail = _fix_code("".join(buf)).rstrip().rstrip(",").rstrip()
+    if tail.endswith(":"):
+        return None
+    candidate = "".join(segs) + tail + "".join(reversed(stack))
+    try:
+        obj = json.loads(candidate)
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+if __name__ == "__main__":
+    # Microbenchmark: python jsonscan.py [size_kb]
+    import sys, time
+
+    def _legacy_extract(text):
+        # brace counter that ignores strings and json.loads every balanced fragment
+        start = -1; depth = 0; last = None
+        for i, ch in enumerate(text):
+            if ch == "{":
+                if depth == 0:
+                    start = i
+                depth += 1
+            elif ch == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    try:
+                        j = json.loads(text[start:i + 1])
+                        if isinstance(j, dict):
+                            last = j
+                    except Exception:
+                        pass
+        return last
+
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    code = 'def f(x):\n    return {"k": x, "s": "a \\"quoted\\" }"}\n' * 8
+    step = json.dumps({"tool": "write_file", "args": {"path": "out.py", "text": code}})
+    chatter = "Sure, here is the call. Note {braces} in prose.\n"
+    unit = chatter + step + "\n"
+    text = unit * max(1, size_kb * 1024 // len(unit))
+    text += json.dumps({"final": "done } really"})
+    mb = len(text) / 1e6
+
+    for name, fn in (("legacy", _legacy_extract), ("extract_last_json_dict", extract_last_json_dict)):
+        reps = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < 1.0:
+            got = fn(text)
+            reps += 1
+        dt = (time.perf_counter() - t0) / reps
+        print(f"{name:24s} {dt * 1e3:8.2f} ms/call  {mb / dt:7.1f} MB/s  -> {str(got)[:40]}")
+
+    # Streaming: LM Studio sends roughly one token (~4 chars) per chunk
+    sc = JsonObjectScanner()
+    chunks = [text[i:i + 4] for i in range(0, len(text), 4)]
+    t0 = time.perf_counter()
+    for c in chunks:
+        sc.feed(c)
+    dt = time.perf_counter() - t0
+    print(f"{'JsonObjectScanner.feed':24s} {dt / len(chunks) * 1e6:8.2f} us/chunk {mb / dt:7.1f} MB/s  (4-char chunks)")
@@ -0,0 +1,172 @@
+"""Caches in front of LM Studio calls."""
+from __future__ import annotations
+import hashlib, json, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share a key."""
+    return " ".join(prompt.split()).casefold()
+
+
+class PlanCache:
+    """LRU + TTL cache of planner replies, optionally backed by a sqlite file.
+
+    Keys combine the model name, a hash of the system prompt (and of the
+    response_format, when one is used) and the user prompt, so changing any
+    of them invalidates old plans. The prompt is normalized unless exact=True;
+    callers key plans that copy text out of the prompt (tool arguments) on
+    the exact prompt.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400.0, path: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, created REAL, plan TEXT)")
+            self._db.execute("DELETE FROM plans WHERE created < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    @staticmethod
+    def key(model: str, system: str, prompt: str, response_format: Optional[Dict[str, Any]] = None,
+            exact: bool = False) -> str:
+        if response_format is not None:
+            system += "\0" + json.dumps(response_format, sort_keys=True)
+        prompt = prompt if exact else "\0" + normalize_prompt(prompt)
+        return _sha(f"{model}\0{_sha(system)}\0{prompt}")
+
+    def get(self, key: str, *more: str) -> Optional[Dict[str, Any]]:
+        """The plan under the first of key, *more that has a live one (one hit or miss either way)."""
+        now = time.time()
+        with self._lock:
+            for k in (key,) + more:
+                entry = self._mem.get(k)
+                if entry is None and self._db is not None:
+                    row = self._db.execute("SELECT created, plan FROM plans WHERE key = ?", (k,)).fetchone()
+                    if row:
+                        entry = (row[0], row[1])
+                        self._remember(k, entry)
+                if entry is None:
+                    continue
+                if now - entry[0] > self.ttl:
+                    self._drop(k)
+                    continue
+                self._mem.move_to_end(k)
+                self.hits += 1
+                return json.loads(entry[1])   # fresh copy per caller
+            self.misses += 1
+            return None
+
+    def put(self, key: str, plan: Dict[str, Any]) -> None:
+        entry = (time.time(), json.dumps(plan))
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO plans VALUES (?, ?, ?)", (key, entry[0], entry[1]))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM plans")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._mem)}
+
+    def _remember(self, key: str, entry: "tuple[float, str]") -> None:
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _drop(self, key: str) -> None:
+        self._mem.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+            self._db.commit()
+
+
+class ResponseCache:
+    """Content-addressed sqlite cache of deterministic completions.
+
+    Keys hash (model, messages, sampling params). When the stored text
+    exceeds max_bytes the least recently used rows are evicted. Set
+    enabled = False to bypass it without dropping what is stored.
+    """
+
+    def __init__(self, path: str = ":memory:", max_bytes: int = 64 * 1024 * 1024, enabled: bool = True) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(key TEXT PRIMARY KEY, used REAL, size INTEGER, text TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._db.commit()
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, messages: Any, **params: Any) -> str:
+        blob = json.dumps({"model": model, "messages": messages, "params": params},
+                          sort_keys=True, ensure_ascii=False, default=str)
+        return _sha(blob)
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        if not self.enabled:
+            return
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, time.time(), size, text))
+            self._bytes += size - (old[0] if old else 0)
+            while self._bytes > self.max_bytes:
+                victim = self._db.execute("SELECT key, size FROM responses ORDER BY used LIMIT 1").fetchone()
+                if victim is None:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (victim[0],))
+                self._bytes -= victim[1]
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries,
+                "bytes": self._bytes, "enabled": self.enabled}
@@ -0,0 +1,131 @@
+"""Shared, pooled OpenAI clients for LM Studio.
+
+    LMSTUDIO_BASE_URL          default http://localhost:1234/v1
+    LMSTUDIO_API_KEY           default lm-studio
+    LMSTUDIO_MODEL             overrides each script's default model name
+    LMSTUDIO_TIMEOUT           read timeout in seconds (default 600; generations are slow)
+    LMSTUDIO_MAX_CONNECTIONS   keep-alive pool size (default 32)
+    LMSTUDIO_KEEPALIVE_EXPIRY  seconds an idle connection stays open (default 120)
+
+One OpenAI client per base URL (and one AsyncOpenAI client per base URL and
+event loop, since an httpx pool is bound to the loop it first ran on) is built
+on first use and shared by every module, so planner, chat and loop calls from
+all callers reuse the same warm HTTP/1.1 connections. httpx's own idle expiry
+is 5 s, which means an interactive session used to reconnect on nearly every
+prompt.
+
+`openai` itself (~0.4 s to import) is only imported when a client is built;
+LazyClient lets modules name their client at import time without paying that.
+"""
+from __future__ import annotations
+import asyncio, os, threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+DEFAULT_BASE_URL = "http://localhost:1234/v1"
+
+_lock = threading.Lock()
+_clients: Dict[tuple, Any] = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def base_url() -> str:
+    return os.environ.get("LMSTUDIO_BASE_URL") or DEFAULT_BASE_URL
+
+
+def model(default: str) -> str:
+    """LMSTUDIO_MODEL if set, else the calling script's default."""
+    return os.environ.get("LMSTUDIO_MODEL") or default
+
+
+def _http_options() -> Dict[str, Any]:
+    from openai import DEFAULT_CONNECTION_LIMITS, Timeout
+    Limits = type(DEFAULT_CONNECTION_LIMITS)   # Limits of whichever httpx build openai uses
+    size = int(_env_float("LMSTUDIO_MAX_CONNECTIONS", 32))
+    return dict(
+        limits=Limits(max_connections=size, max_keepalive_connections=size,
+                      keepalive_expiry=_env_float("LMSTUDIO_KEEPALIVE_EXPIRY", 120.0)),
+        timeout=Timeout(_env_float("LMSTUDIO_TIMEOUT", 600.0), connect=5.0),
+        http2=False,
+    )
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _get(kind: str, url: Optional[str]):
+    url = url or base_url()
+    key = (kind, url, _running_loop() if kind == "async" else None)
+    c = _clients.get(key)
+    if c is not None:
+        return c
+    with _lock:
+        c = _clients.get(key)
+        if c is None:
+            # clients of finished asyncio.run() loops can't be reused (or closed); forget them
+            for k in [k for k in _clients if k[2] is not None and k[2].is_closed()]:
+                del _clients[k]
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+            api_key = os.environ.get("LMSTUDIO_API_KEY") or "lm-studio"
+            if kind == "sync":
+                c = OpenAI(base_url=url, api_key=api_key, http_client=DefaultHttpxClient(**_http_options()))
+            else:
+                c = AsyncOpenAI(base_url=url, api_key=api_key,
+                                http_client=DefaultAsyncHttpxClient(**_http_options()))
+            _clients[key] = c
+        return c
+
+
+def client(url: Optional[str] = None) -> "OpenAI":
+    """Shared OpenAI client for url (default: LMSTUDIO_BASE_URL)."""
+    return _get("sync", url)
+
+
+def async_client(url: Optional[str] = None) -> "AsyncOpenAI":
+    """Shared AsyncOpenAI client for the running event loop (call it inside the loop)."""
+    return _get("async", url)
+
+
+class LazyClient:
+    """Stand-in for client() / async_client() that looks the shared client up on each attribute access.
+
+        LM = LazyClient()                    # LM.chat.completions.create(...) works as usual
+        ALM = LazyClient(asynchronous=True)
+
+    The client is built on first use and nothing is cached here, so after
+    reset() the next access gets a fresh one.
+    """
+    __slots__ = ("_kind", "_url")
+
+    def __init__(self, url: Optional[str] = None, asynchronous: bool = False) -> None:
+        self._kind = "async" if asynchronous else "sync"
+        self._url = url
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_get(self._kind, self._url), name)
+
+    @property
+    def loaded(self) -> bool:
+        loop = _running_loop() if self._kind == "async" else None
+        return (self._kind, self._url or base_url(), loop) in _clients
+
+
+def reset() -> None:
+    """Close the sync clients and forget all of them (e.g. after changing the environment)."""
+    with _lock:
+        for (kind, _, _), c in _clients.items():
+            if kind == "sync":
+                c.close()
+        _clients.clear()
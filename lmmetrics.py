@@ -0,0 +1,91 @@
+"""Per-call usage and latency records for every LLM call.
+
+Each call produces one dict: ts, model, stage (planner / chat / fallback /
+loop step N ...), outcome (ok / cached / stopped / error: ...), wall_s,
+ttft_s, prompt_tokens, completion_tokens. Records are kept in memory
+(records(), summary()) and, when LLM_METRICS_PATH is set or configure()
+is given a path, appended to a JSONL file.
+"""
+from __future__ import annotations
+import json, os, threading, time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+_lock = threading.Lock()
+_records: Deque[Dict[str, Any]] = deque(maxlen=10000)
+_path: Optional[str] = os.environ.get("LLM_METRICS_PATH") or None
+
+
+def configure(path: Optional[str] = None, max_records: int = 10000) -> None:
+    """Set (or clear, with None) the JSONL file and the in-memory record limit."""
+    global _path, _records
+    with _lock:
+        _path = path
+        if max_records != _records.maxlen:
+            _records = deque(_records, maxlen=max_records)
+
+
+def usage_tokens(usage: Any) -> tuple:
+    """(prompt_tokens, completion_tokens) from a response usage object, if any."""
+    if usage is None:
+        return None, None
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+def record(model: str, stage: str, outcome: str, wall_s: float, ttft_s: Optional[float] = None,
+           prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> Dict[str, Any]:
+    rec = {
+        "ts": round(time.time(), 3),
+        "model": model,
+        "stage": stage,
+        "outcome": outcome,
+        "wall_s": round(wall_s, 4),
+        "ttft_s": round(ttft_s, 4) if ttft_s is not None else None,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+    with _lock:
+        _records.append(rec)
+        if _path:
+            with open(_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec) + "\n")
+    return rec
+
+
+def records(stage: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _lock:
+        return [r for r in _records if stage is None or r["stage"] == stage]
+
+
+def reset() -> None:
+    with _lock:
+        _records.clear()
+
+
+def _stage_group(stage: str) -> str:
+    # "loop step 7" -> "loop step"
+    head, _, tail = stage.rpartition(" ")
+    return head if head and tail.isdigit() else stage
+
+
+def summary() -> Dict[str, Dict[str, Any]]:
+    """Totals per stage (loop steps grouped): calls, wall time, tokens, mean TTFT."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in records():
+        s = out.setdefault(_stage_group(r["stage"]), {
+            "calls": 0, "cached": 0, "errors": 0, "wall_s": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "_ttft": [],
+        })
+        s["calls"] += 1
+        s["cached"] += r["outcome"] == "cached"
+        s["errors"] += r["outcome"].startswith("error")
+        s["wall_s"] += r["wall_s"]
+        s["prompt_tokens"] += r["prompt_tokens"] or 0
+        s["completion_tokens"] += r["completion_tokens"] or 0
+        if r["ttft_s"] is not None:
+            s["_ttft"].append(r["ttft_s"])
+    for s in out.values():
+        t = s.pop("_ttft")
+        s["wall_s"] = round(s["wall_s"], 4)
+        s["mean_ttft_s"] = round(sum(t) / len(t), 4) if t else None
+    return out
@@ -0,0 +1,177 @@
+"""Nested timing spans, exported as Chrome trace-event JSON.
+
+    LLM_TRACE_PATH=trace.json python agent.py      # written at exit
+    lmtrace.enable(); ...; lmtrace.export("trace.json")
+
+Open the file in chrome://tracing or https://ui.perfetto.dev. Each thread
+(and each asyncio task) gets its own track, so concurrent queries do not
+interleave; work handed to asyncio.to_thread() stays on its caller's track
+(the track id is a context variable, and to_thread copies the context). The
+newest max_events events are kept. While disabled, span() returns a shared
+no-op context manager and complete() returns immediately.
+"""
+from __future__ import annotations
+import asyncio, atexit, contextvars, functools, inspect, itertools, json, os, threading, time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+ENABLED = False
+_lock = threading.Lock()
+_events: Deque[Dict[str, Any]] = deque(maxlen=100000)
+_tids = itertools.count(1)
+# (id of the owning asyncio task or None, track id)
+_track_var: contextvars.ContextVar[Optional[Tuple[Optional[int], int]]] = \
+    contextvars.ContextVar("lmtrace_track", default=None)
+_t0 = time.perf_counter()
+_pid = os.getpid()
+_path: Optional[str] = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+def _track() -> int:
+    """Track of the current asyncio task, else of the current thread (or the task it runs for)."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    owner = id(task) if task is not None else None
+    cur = _track_var.get()
+    # a new task inherits its creator's context but gets its own track;
+    # a to_thread() worker keeps the awaiting task's
+    if cur is not None and (owner is None or cur[0] == owner):
+        return cur[1]
+    tid = next(_tids)
+    _track_var.set((owner, tid))
+    return tid
+
+
+def _emit(name: str, cat: str, start: float, dur: float, tid: int, args: Dict[str, Any]) -> None:
+    ev = {"name": name, "cat": cat, "ph": "X", "pid": _pid, "tid": tid,
+          "ts": round((start - _t0) * 1e6, 1), "dur": round(dur * 1e6, 1)}
+    if args:
+        ev["args"] = args
+    with _lock:
+        _events.append(ev)
+
+
+def complete(name: str, cat: str, start: float, dur: float, **args: Any) -> None:
+    """Add a finished span; start is a time.perf_counter() value, dur in seconds."""
+    if not ENABLED:
+        return
+    _emit(name, cat, start, dur, _track(), args)
+
+
+def instant(name: str, cat: str = "agent", **args: Any) -> None:
+    """Add a zero-length marker (e.g. a routing decision) to the current track."""
+    if not ENABLED:
+        return
+    ev = {"name": name, "cat": cat, "ph": "i", "s": "t", "pid": _pid, "tid": _track(),
+          "ts": round((time.perf_counter() - _t0) * 1e6, 1)}
+    if args:
+        ev["args"] = args
+    with _lock:
+        _events.append(ev)
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start", "tid")
+
+    def __init__(self, name: str, cat: str, args: Dict[str, Any]) -> None:
+        self.name, self.cat, self.args = name, cat, args
+
+    def __enter__(self):
+        self.tid = _track()   # claimed up front so to_thread() work inside inherits it
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        _emit(self.name, self.cat, self.start, time.perf_counter() - self.start, self.tid, self.args)
+        return False
+
+    def set(self, **args: Any) -> None:
+        """Attach extra args (e.g. the route taken) before the span closes."""
+        self.args.update(args)
+
+
+def span(name: str, cat: str = "agent", **args: Any):
+    return _Span(name, cat, args) if ENABLED else _NULL
+
+
+def traced(name: Optional[str] = None, cat: str = "agent") -> Callable:
+    """Decorator: run the (sync or async) function inside span(name)."""
+    def deco(fn: Callable) -> Callable:
+        label = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*a, **kw):
+                if not ENABLED:
+                    return await fn(*a, **kw)
+                with _Span(label, cat, {}):
+                    return await fn(*a, **kw)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if not ENABLED:
+                return fn(*a, **kw)
+            with _Span(label, cat, {}):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+
+def enable(path: Optional[str] = None, max_events: int = 100000) -> None:
+    """Start recording, keeping the newest max_events; with a path, the trace is also written at exit."""
+    global ENABLED, _path, _events
+    with _lock:
+        if max_events != _events.maxlen:
+            _events = deque(_events, maxlen=max_events)
+    ENABLED = True
+    if path and _path is None:
+        atexit.register(lambda: export(_path))
+    _path = path or _path
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def events() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_events)
+
+
+def clear() -> None:
+    with _lock:
+        _events.clear()
+
+
+def export(path: str) -> int:
+    """Write {"traceEvents": [...]} to path; returns the number of events."""
+    evs = events()
+    meta = [{"name": "process_name", "ph": "M", "pid": _pid, "args": {"name": "LMStudioPlayground"}}]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": meta + evs, "displayTimeUnit": "ms"}, f)
+    return len(evs)
+
+
+if os.environ.get("LLM_TRACE_PATH"):
+    enable(os.environ["LLM_TRACE_PATH"])
@@ -0,0 +1,316 @@
+"""Stand-in for LM Studio's OpenAI-compatible server, for offline tests and benchmarks.
+
+    python mock_lmstudio.py --port 1234 --script replies.json --ttft 0.3 --tok-per-s 40
+
+    with MockServer(rules=[{"match": "joke", "reply": "No."}], ttft=0.05) as srv:
+        client = OpenAI(base_url=srv.base_url, api_key="lm-studio")
+
+Implements GET /v1/models and POST /v1/chat/completions (non-streamed, and
+streamed as SSE with stream_options.include_usage). Replies come from a list
+of rules, tried in order:
+
+    {"match": "<regex>", "on": "last|user|system|any", "reply": ..., "times": N,
+     "ttft": s, "tok_per_s": r}
+
+"on" picks the text the regex is searched in (default "last": the newest
+message, which is TOOL_RESULT / tool output inside an agent loop). "reply" is
+a string, {"content": ..., "tool_calls": [{"name": ..., "arguments": {...}}]},
+or a list of those handed out in turn (the last one repeats). "times" retires
+a rule after N uses. Unmatched requests get `default` (an echo if unset).
+
+Timing per request: wait for a free slot (parallel=1 serialises like a single
+loaded model), sleep `latency`, then `ttft` before the first token and
+1/tok_per_s between tokens. Usage counts are estimated at ~4 chars per token.
+"""
+from __future__ import annotations
+import argparse, json, re, sys, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Union
+
+Reply = Union[str, Dict[str, Any]]
+_TOKEN_RE = re.compile(r"\s*\S{1,4}|\s+")
+
+
+def split_tokens(text: str) -> List[str]:
+    """Chop text into short token-sized pieces (whitespace kept, so they rejoin exactly)."""
+    return _TOKEN_RE.findall(text)
+
+
+def _est_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def _content(m: Dict[str, Any]) -> str:
+    c = m.get("content") or ""
+    if isinstance(c, list):   # content parts
+        c = " ".join(p.get("text", "") for p in c if isinstance(p, dict))
+    return c
+
+
+def prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimated prompt size of a request, as reported in its usage block."""
+    return sum(_est_tokens(_content(m)) for m in messages or [])
+
+
+class _Rule:
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.regex = re.compile(spec.get("match", ""), re.IGNORECASE | re.DOTALL)
+        self.on = spec.get("on", "last")
+        reply = spec.get("reply", "")
+        self.replies: List[Reply] = list(reply) if isinstance(reply, list) else [reply]
+        self.times: Optional[int] = spec.get("times")
+        self.ttft: Optional[float] = spec.get("ttft")
+        self.tok_per_s: Optional[float] = spec.get("tok_per_s")
+        self.used = 0
+
+    def target(self, messages: List[Dict[str, Any]]) -> str:
+        if not messages:
+            return ""
+        if self.on == "any":
+            return "\n".join(_content(m) for m in messages)
+        if self.on in ("user", "system"):
+            for m in reversed(messages):
+                if m.get("role") == self.on:
+                    return _content(m)
+            return ""
+        return _content(messages[-1])
+
+    def take(self, messages: List[Dict[str, Any]]) -> Optional[Reply]:
+        if self.times is not None and self.used >= self.times:
+            return None
+        if not self.regex.search(self.target(messages)):
+            return None
+        reply = self.replies[min(self.used, len(self.replies) - 1)]
+        self.used += 1
+        return reply
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)   # clients hanging up early is normal
+
+
+class MockServer:
+    """Threaded mock server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None, default: Optional[Reply] = None,
+                 responder: Optional[Callable[[Dict[str, Any]], Optional[Reply]]] = None,
+                 host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, ttft: float = 0.0,
+                 tok_per_s: float = 0.0, parallel: Optional[int] = None,
+                 models: Optional[List[str]] = None) -> None:
+        self.rules = [_Rule(r) for r in rules or []]
+        self.default = default
+        self.responder = responder
+        self.latency = latency
+        self.ttft = ttft
+        self.tok_per_s = tok_per_s
+        self.models = models or ["mock-model"]
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self._httpd = _HTTPServer((host, port), _make_handler(self))
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            for r in self.rules:
+                r.used = 0
+
+    def choose(self, body: Dict[str, Any]) -> "tuple[Reply, float, float]":
+        """(reply, ttft, tok_per_s) for a chat request."""
+        messages = body.get("messages") or []
+        with self._lock:
+            self.requests.append(body)
+            if self.responder is not None:
+                reply = self.responder(body)
+                if reply is not None:
+                    return reply, self.ttft, self.tok_per_s
+            for rule in self.rules:
+                reply = rule.take(messages)
+                if reply is not None:
+                    ttft = self.ttft if rule.ttft is None else rule.ttft
+                    rate = self.tok_per_s if rule.tok_per_s is None else rule.tok_per_s
+                    return reply, ttft, rate
+        if self.default is not None:
+            return self.default, self.ttft, self.tok_per_s
+        last = _content(messages[-1]) if messages else ""
+        return f"(mock) {last}", self.ttft, self.tok_per_s
+
+
+def _normalize(reply: Reply) -> "tuple[str, List[Dict[str, Any]]]":
+    if isinstance(reply, str):
+        return reply, []
+    calls = []
+    for c in reply.get("tool_calls") or []:
+        args = c.get("arguments", {})
+        calls.append({
+            "id": c.get("id") or f"call_{uuid.uuid4().hex[:8]}",
+            "type": "function",
+            "function": {"name": c["name"], "arguments": args if isinstance(args, str) else json.dumps(args)},
+        })
+    return reply.get("content") or "", calls
+
+
+def _make_handler(server: MockServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so client pooling is measurable
+
+        def log_message(self, fmt, *args):   # quiet
+            pass
+
+        def _json(self, code: int, obj: Any) -> None:
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") == "/v1/models":
+                self._json(200, {"object": "list", "data": [
+                    {"id": m, "object": "model", "owned_by": "mock"} for m in server.models]})
+            else:
+                self._json(404, {"error": {"message": f"no route {self.path}"}})
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/v1/chat/completions":
+                self._json(404, {"error": {"message": f"no route {self.path}"}})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            except ValueError:
+                self._json(400, {"error": {"message": "invalid JSON body"}})
+                return
+            reply, ttft, rate = server.choose(body)
+            if server._slots is not None:
+                server._slots.acquire()
+            try:
+                if server.latency:
+                    time.sleep(server.latency)
+                if body.get("stream"):
+                    self._stream(body, reply, ttft, rate)
+                else:
+                    self._complete(body, reply, ttft, rate)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True   # client stopped reading (stop_on_json, cancel)
+            finally:
+                if server._slots is not None:
+                    server._slots.release()
+
+        def _usage(self, body, text, calls) -> Dict[str, int]:
+            prompt = prompt_tokens(body.get("messages"))
+            completion = len(split_tokens(text)) + sum(_est_tokens(c["function"]["arguments"]) for c in calls)
+            return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+        def _complete(self, body, reply, ttft, rate) -> None:
+            text, calls = _normalize(reply)
+            n = len(split_tokens(text))
+            time.sleep(ttft + (max(0, n - 1) / rate if rate else 0.0))
+            message: Dict[str, Any] = {"role": "assistant", "content": text}
+            if calls:
+                message["tool_calls"] = calls
+            self._json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+                "created": int(time.time()), "model": body.get("model", server.models[0]),
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if calls else "stop"}],
+                "usage": self._usage(body, text, calls),
+            })
+
+        def _send_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _event(self, obj: Any) -> None:
+            self._send_chunk(b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n")
+
+        def _stream(self, body, reply, ttft, rate) -> None:
+            text, calls = _normalize(reply)
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            base = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body.get("model", server.models[0])}
+
+            def chunk(delta, finish=None):
+                return dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish}])
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self._event(chunk({"role": "assistant", "content": ""}))
+            time.sleep(ttft)
+            for i, tok in enumerate(split_tokens(text)):
+                if i and rate:
+                    time.sleep(1.0 / rate)
+                self._event(chunk({"content": tok}))
+            for i, c in enumerate(calls):
+                self._event(chunk({"tool_calls": [dict(c, index=i)]}))
+            self._event(chunk({}, "tool_calls" if calls else "stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._event(dict(base, choices=[], usage=self._usage(body, text, calls)))
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")   # end of chunked body
+
+    return Handler
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Mock LM Studio (OpenAI-compatible) server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1234)
+    ap.add_argument("--script", help="JSON file: a list of rules, or {\"rules\": [...], \"default\": ...}")
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds before the response starts")
+    ap.add_argument("--ttft", type=float, default=0.0, help="seconds to the first token")
+    ap.add_argument("--tok-per-s", type=float, default=0.0, help="decode rate (0 = instant)")
+    ap.add_argument("--parallel", type=int, default=0, help="requests served at once (0 = unlimited)")
+    ap.add_argument("--model", action="append", help="model id for /v1/models (repeatable)")
+    a = ap.parse_args(argv)
+
+    rules, default = [], None
+    if a.script:
+        with open(a.script, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        if isinstance(spec, dict):
+            rules, default = spec.get("rules", []), spec.get("default")
+        else:
+            rules = spec
+    srv = MockServer(rules=rules, default=default, host=a.host, port=a.port, latency=a.latency,
+                     ttft=a.ttft, tok_per_s=a.tok_per_s, parallel=a.parallel or None, models=a.model)
+    print(f"[mock] serving {srv.base_url} ({len(rules)} rules)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules are flat scripts at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+import agent
+import fileindex
+
+
+@pytest.fixture(autouse=True)
+def root(tmp_path, monkeypatch):
+    (tmp_path / "notes.txt").write_text("hello\n")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "app.py").write_text("print(1)\n")
+    monkeypatch.setattr(agent, "ROOT", str(tmp_path))
+    monkeypatch.setattr(agent, "known_files", set())
+    monkeypatch.setattr(fileindex, "_dir_indexes", {})
+    return tmp_path
+
+
+@pytest.mark.parametrize("prompt, expr", [
+    ("12*7", "12*7"),
+    ("calc 2^10", "2^10"),
+    ("what is (3+4)*2?", "(3+4)*2"),
+    ("10 - 3 + 1", "10 - 3 + 1"),
+    ("what is 10-3", "10-3"),
+    ("calc 2024-10-15", "2024-10-15"),
+])
+def test_fast_route_arithmetic(prompt, expr):
+    assert agent.fast_route(prompt) == ({"tool": "calc", "args": {"expr": expr}}, 0.95)
+
+
+@pytest.mark.parametrize("prompt", ["2024-10-15", "555-1234", "-5", "1.5", "42"])
+def test_fast_route_leaves_dash_only_numbers_alone(prompt):
+    action, conf = agent.fast_route(prompt)
+    assert conf < agent.FAST_ROUTE_THRESHOLD
+    assert action is None or action["tool"] != "calc"
+
+
+def test_fast_route_existing_path():
+    assert agent.fast_route("show notes.txt") == ({"tool": "read_file", "args": {"path": "notes.txt"}}, 0.95)
+    assert agent.fast_route("src/app.py") == ({"tool": "read_file", "args": {"path": "src/app.py"}}, 0.95)
+    action, conf = agent.fast_route("is notes.txt long?")
+    assert action == {"tool": "read_file", "args": {"path": "notes.txt"}} and conf == 0.6
+
+
+def test_fast_route_missing_path_is_not_confident():
+    assert agent.fast_route("read missing.txt") == ({"tool": "read_file", "args": {"path": "missing.txt"}}, 0.4)
+
+
+def test_fast_route_leaves_writes_to_the_planner():
+    assert agent.fast_route("write hello to notes.txt") == (None, 0.0)
+    assert agent.fast_route("delete src/app.py") == (None, 0.0)
+
+
+def test_fast_route_sees_files_created_after_first_lookup(root):
+    assert agent.fast_route("show later.txt")[1] == 0.4
+    (root / "later.txt").write_text("x")
+    fileindex.changed(str(root), "later.txt")
+    assert agent.fast_route("show later.txt")[1] == 0.95
+
+
+def test_fast_route_nothing_to_do():
+    assert agent.fast_route("tell me a joke") == (None, 0.0)
+    assert agent.fast_route("   ") == (None, 0.0)
+
+
+def test_plan_cache_reuses_only_chat_plans_across_case(monkeypatch):
+    replies = {"write Hello World to out.txt": '{"route": "tool", "tool": "write_file", '
+                                               '"args": {"path": "out.txt", "text": "Hello World"}}',
+               "write hello world to out.txt": '{"route": "tool", "tool": "write_file", '
+                                               '"args": {"path": "out.txt", "text": "hello world"}}',
+               "Tell me a joke": '{"route": "chat", "tool": null, "args": {}, "confidence": 0.9}'}
+    calls = []
+
+    def fake_llm(messages, **kw):
+        calls.append(messages[-1]["content"])
+        return replies[messages[-1]["content"]]
+
+    monkeypatch.setattr(agent, "llm", fake_llm)
+    monkeypatch.setattr(agent, "PLAN_CACHE", agent.PlanCache())
+    assert agent.plan_route("write Hello World to out.txt")["args"]["text"] == "Hello World"
+    assert agent.plan_route("write hello world to out.txt")["args"]["text"] == "hello world"
+    assert agent.plan_route("write Hello World to out.txt")["args"]["text"] == "Hello World"
+    assert agent.plan_route("Tell me a joke")["route"] == "chat"
+    assert agent.plan_route("tell me  a JOKE")["route"] == "chat"
+    assert calls == ["write Hello World to out.txt", "write hello world to out.txt", "Tell me a joke"]
+
+
+def test_speculative_chat_skipped_on_cached_plan(monkeypatch):
+    def no_speculation(messages):
+        raise AssertionError("speculative chat started for a cached plan")
+
+    monkeypatch.setattr(agent, "SPECULATIVE_CHAT", True)
+    monkeypatch.setattr(agent, "_SpeculativeChat", no_speculation)
+    monkeypatch.setattr(agent, "_SpeculativeChatAsync", no_speculation)
+    monkeypatch.setattr(agent, "PLAN_CACHE", agent.PlanCache())
+    monkeypatch.setattr(agent, "llm", lambda *a, **kw: pytest.fail("planner called for a cached plan"))
+    prompt = "please add up twelve and thirty"
+    agent._remember_plan(prompt, {"route": "tool", "tool": "calc", "args": {"expr": "12+30"}, "confidence": 0.9})
+    info = {}
+    assert agent.run_query(prompt, info=info) == "[TOOL RESULT] 42"
+    assert info["route"] == "tool"
+    assert asyncio.run(agent.run_query_async(prompt)) == "[TOOL RESULT] 42"
@@ -0,0 +1,173 @@
+import os
+
+import pytest
+
+import fileindex
+from fileindex import DirIndex, SearchIndex, format_hits
+
+
+def _tree(root, files):
+    for rel, text in files.items():
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(text)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    _tree(tmp_path, {
+        "a.txt": "alpha\n",
+        "src/main.py": "def main():\n    return plan_cache\n",
+        "src/util/a.txt": "nested\n",
+        ".git/config": "[core]\n",
+        "node_modules/pkg/index.js": "x\n",
+        ".hidden/notes.md": "secret\n",
+    })
+    return tmp_path
+
+
+def test_dir_index_has_and_find(tree):
+    idx = DirIndex(str(tree), ttl=3600)
+    assert idx.has("a.txt") and idx.has("src/main.py") and idx.has("./src/util/a.txt")
+    assert not idx.has("missing.txt") and not idx.has("src")
+    assert sorted(idx.find("a.txt")) == ["a.txt", os.path.join("src", "util", "a.txt")]
+    assert idx.find("index.js") == []
+    assert idx.complete
+
+
+def test_dir_index_unwalked_dirs_fall_back_to_disk(tree):
+    idx = DirIndex(str(tree), ttl=3600)
+    assert idx.has(".git/config")
+    assert idx.has("node_modules/pkg/index.js")
+    assert idx.has(".hidden/notes.md")
+    assert not idx.has(".hidden/nope.md")
+
+
+def test_dir_index_symlinked_dir(tree, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside")
+    (outside / "linked.txt").write_text("x")
+    os.symlink(outside, tree / "link")
+    idx = DirIndex(str(tree), ttl=3600)
+    assert idx.has("link/linked.txt")
+    assert idx.find("linked.txt") == []
+
+
+def test_dir_index_parent_paths(tree):
+    idx = DirIndex(str(tree / "src"), ttl=3600)
+    assert idx.has("../a.txt")
+    assert idx.has(str(tree / "a.txt"))
+    (tree / "src" / "..foo").write_text("x")
+    assert idx.has("..foo")
+
+
+def test_dir_index_has_sees_changes_in_the_looked_up_dir(tree):
+    idx = DirIndex(str(tree), ttl=3600)
+    assert not idx.has("src/new.py")
+    (tree / "src" / "new.py").write_text("x")
+    assert idx.has("src/new.py")               # src's mtime changed
+    os.remove(tree / "src" / "main.py")
+    assert not idx.has("src/main.py")
+    (tree / "src" / "pkg").mkdir()
+    (tree / "src" / "pkg" / "mod.py").write_text("x")
+    assert idx.has("src/pkg/mod.py")           # not walked yet: checked on disk
+
+
+def test_dir_index_invalidate_sees_new_file(tree):
+    idx = DirIndex(str(tree), ttl=3600)
+    src = tree / "src"
+    assert not idx.has("src/new.py")
+    st = os.stat(src)
+    (src / "new.py").write_text("x")
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns))   # a change the mtime does not show
+    assert not idx.has("src/new.py")
+    idx.invalidate("src/new.py")
+    assert idx.has("src/new.py")
+    assert idx.find("new.py") == [os.path.join("src", "new.py")]
+
+
+def test_dir_index_lookup_stats_one_dir(tree, monkeypatch):
+    _tree(tree, {f"d{i}/sub/f.txt": "x" for i in range(50)})
+    idx = DirIndex(str(tree))
+    assert idx.has("d0/sub/f.txt")
+    calls = []
+    real_stat = os.stat
+    monkeypatch.setattr(fileindex.os, "stat", lambda p, *a, **k: calls.append(p) or real_stat(p, *a, **k))
+    monkeypatch.setattr(fileindex.time, "monotonic", lambda: 1e12)   # long past the ttl
+    scans = idx.rescans
+    assert idx.has("d7/sub/f.txt") and not idx.has("d7/sub/g.txt") and idx.has("a.txt")
+    assert len(calls) == 3 and idx.rescans == scans
+
+
+def test_dir_index_refresh_relists_only_changed_dirs(tree):
+    idx = DirIndex(str(tree), ttl=0)
+    idx.refresh()
+    first = idx.rescans
+    idx.refresh()
+    assert idx.rescans == first
+    idx.invalidate("src/main.py")
+    idx.refresh()
+    assert idx.rescans == first + 1
+
+
+def test_dir_index_bounds(tmp_path):
+    _tree(tmp_path, {f"d{i}/f{j}.txt": "x" for i in range(5) for j in range(5)})
+    idx = DirIndex(str(tmp_path), max_files=7, ttl=3600)
+    idx.refresh()
+    assert not idx.complete
+    assert len(idx._paths) <= 7
+    assert all(idx.has(f"d{i}/f{j}.txt") for i in range(5) for j in range(5))
+    assert not idx.has("d0/f9.txt")
+
+    idx = DirIndex(str(tmp_path), max_dirs=2, ttl=3600)
+    idx.refresh()
+    assert not idx.complete and idx.rescans == 2
+    assert all(idx.has(f"d{i}/f0.txt") for i in range(5))
+
+
+def test_search_all_words_then_any_word(tree):
+    _tree(tree, {"docs/cache.md": "the plan cache\nonly plan here\n", "docs/other.md": "cache only\n"})
+    idx = SearchIndex(str(tree), ttl=3600)
+    hits = idx.search("plan cache")
+    assert [(h.path, h.line) for h in hits] == [(os.path.join("docs", "cache.md"), 1)]
+    hits = idx.search("plan zebra")
+    assert {(h.path, h.line) for h in hits} == {(os.path.join("docs", "cache.md"), 1),
+                                               (os.path.join("docs", "cache.md"), 2)}
+    assert idx.search("zebra") == [] and idx.search("?") == []
+
+
+def test_search_regex_and_skipped_files(tree):
+    _tree(tree, {"bin.dat": "def main_x():\0", "big.py": "def huge():\n" * 100})
+    idx = SearchIndex(str(tree), max_file_bytes=200, ttl=3600)
+    hits = idx.search(r"def \w+\(", regex=True)
+    assert [h.path for h in hits] == [os.path.join("src", "main.py")]
+    assert idx.search("secret") == [] and idx.search("index") == []   # dot-dirs and node_modules
+
+
+def test_search_index_refresh_and_changed(tree, monkeypatch):
+    monkeypatch.setattr(fileindex, "_indexes", {})
+    monkeypatch.setattr(fileindex, "_dir_indexes", {})
+    idx = fileindex.index_for(str(tree))
+    idx.ttl = 3600
+    assert idx.search("zebra") == []
+    read = idx.reindexed
+    (tree / "src" / "main.py").write_text("zebra crossing\n")
+    (tree / "zoo.txt").write_text("a zebra\n")
+    assert idx.search("zebra") == []           # within ttl
+    fileindex.changed(str(tree), "zoo.txt")
+    assert {h.path for h in idx.search("zebra")} == {"zoo.txt", os.path.join("src", "main.py")}
+    assert idx.reindexed == read + 2
+    os.remove(tree / "zoo.txt")
+    idx.invalidate()
+    assert [h.path for h in idx.search("zebra")] == [os.path.join("src", "main.py")]
+    assert fileindex.dir_index_for(str(tree)) is fileindex.dir_index_for(str(tree) + os.sep)
+
+
+def test_search_max_hits_and_format(tree):
+    _tree(tree, {"many.txt": "word\n" * 10})
+    idx = SearchIndex(str(tree), ttl=3600)
+    hits = idx.search("word", max_hits=3)
+    assert len(hits) == 3
+    out = format_hits(hits, 3)
+    assert out.splitlines()[0] == "many.txt:1: word"
+    assert out.endswith("[3 hits in 1 files (limit reached)]")
+    assert format_hits([], 3) == "no matches"
@@ -0,0 +1,186 @@
+import os
+
+import pytest
+
+import fileio
+from fileio import FileCache, ReadResult, read_bytes, read_lines, read_tail, read_text, read_window, render
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # Tiny blocks so every test crosses block boundaries
+    monkeypatch.setattr(fileio, "BLOCK", 7)
+
+
+def _file(tmp_path, data, name="f.txt"):
+    p = tmp_path / name
+    p.write_bytes(data.encode("utf-8") if isinstance(data, str) else data)
+    return str(p)
+
+
+def test_read_text_keeps_multibyte_chars_across_blocks(tmp_path):
+    text = "héllo wörld ✓ " * 20
+    p = _file(tmp_path, text)
+    assert read_text(p, 10_000) == ReadResult(text, len(text.encode("utf-8")), False)
+    res = read_text(p, 15)
+    assert res.text == text[:15] and res.truncated
+
+
+def test_read_text_exact_length_is_not_truncated(tmp_path):
+    p = _file(tmp_path, "abcdefghij")
+    assert not read_text(p, 10).truncated
+    assert read_text(p, 9).truncated
+
+
+def test_line_endings_match_text_mode(tmp_path):
+    data = b"a\r\nb\rc\n" * 5 + b"end\r"
+    p = _file(tmp_path, data)
+    with open(p, encoding="utf-8") as f:
+        expected = f.read()
+    assert read_text(p, 10_000).text == expected
+    assert read_lines(p, 1, None, 10_000).text == expected
+    assert read_tail(p, 100, 10_000).text == expected
+    assert read_bytes(p, 0, None, 10_000).text == expected
+
+
+@pytest.mark.parametrize("eol", ["\r", "\r\n", "\n"])
+@pytest.mark.parametrize("block", [1, 2, 3, 7])
+def test_read_lines_and_tail_count_cr_and_crlf(tmp_path, monkeypatch, eol, block):
+    monkeypatch.setattr(fileio, "BLOCK", block)   # some "\r\n" pairs straddle two blocks
+    lines = [f"row {i}" for i in range(1, 9)]
+    p = _file(tmp_path, eol.join(lines) + eol)
+    for start in range(1, 9):
+        res = read_lines(p, start, start + 1, 10_000)
+        assert res.text == "\n".join(lines[start - 1:start + 1]) + "\n"
+        assert res.span == f"lines {start}-{min(start + 1, 8)}"
+    assert read_lines(p, 9, None, 10_000).text == ""
+    assert read_tail(p, 3, 10_000).text == "\n".join(lines[-3:]) + "\n"
+
+
+def test_read_bytes_skips_partial_leading_char(tmp_path):
+    p = _file(tmp_path, "aé✓b")          # a=0, é=1-2, ✓=3-5, b=6
+    res = read_bytes(p, 2, None, 100)
+    assert res.text == "✓b" and res.span == "bytes 3-7"
+    res = read_bytes(p, 0, 4, 100)        # the window ends inside ✓
+    assert res.text == "aé" and res.span == "bytes 0-3"
+    assert read_bytes(p, 100, None, 100).text == ""
+
+
+def test_read_bytes_truncates_to_max_chars(tmp_path):
+    p = _file(tmp_path, "0123456789" * 10)
+    res = read_bytes(p, 5, 50, 20)
+    assert res.text == ("0123456789" * 3)[5:25]
+    assert res.truncated and res.span == "bytes 5-25"
+
+
+def test_read_lines_ranges(tmp_path):
+    lines = [f"line {i}\n" for i in range(1, 31)]
+    p = _file(tmp_path, "".join(lines))
+    res = read_lines(p, 10, 12, 10_000)
+    assert res.text == "".join(lines[9:12]) and res.span == "lines 10-12"
+    res = read_lines(p, 29, None, 10_000)
+    assert res.text == "".join(lines[28:]) and res.span == "lines 29-30"
+    res = read_lines(p, 5, 100, 10_000)
+    assert res.text == "".join(lines[4:]) and not res.truncated
+
+
+def test_read_lines_past_end_and_without_final_newline(tmp_path):
+    p = _file(tmp_path, "one\ntwo\nthree")
+    assert read_lines(p, 3, 3, 100).text == "three"
+    assert read_lines(p, 3, 3, 100).span == "lines 3-3"
+    res = read_lines(p, 10, None, 100)
+    assert res == ReadResult("", res.size, False, "line 10")
+    assert read_lines(p, 1, 2, 5).truncated
+
+
+def test_read_tail(tmp_path):
+    lines = [f"row {i} ✓\n" for i in range(1, 41)]
+    p = _file(tmp_path, "".join(lines))
+    res = read_tail(p, 3, 10_000)
+    assert res.text == "".join(lines[-3:]) and res.span == "last 3 lines"
+    assert not res.truncated
+    assert read_tail(p, 1000, 100_000).text == "".join(lines)
+    assert read_tail(p, 0, 100).text == ""
+
+
+def test_read_tail_splits_only_on_newlines(tmp_path):
+    lines = ["line1\n", "line2 \x0c form\n", "line3 \u2028 sep\n", "line4 \x85\x0b\x1c\n"]
+    p = _file(tmp_path, "".join(lines))
+    assert read_tail(p, 2, 10_000).text == "".join(lines[2:]) == read_lines(p, 3, None, 10_000).text
+    assert read_tail(p, 10, 10_000).span == "last 4 lines"
+
+
+def test_read_tail_byte_cap_keeps_the_end(tmp_path):
+    p = _file(tmp_path, "".join(f"{i:04d}\n" for i in range(2000)))
+    res = read_tail(p, 2000, 30)
+    assert res.truncated
+    assert res.text.endswith("1999\n")
+    assert len(res.text) <= 30
+
+
+def test_read_window_dispatch_and_errors(tmp_path):
+    p = _file(tmp_path, "a\nb\nc\n")
+    assert read_window(p, 100).text == "a\nb\nc\n"
+    assert read_window(p, 100, offset="2").span == "bytes 2-6"
+    assert read_window(p, 100, start_line=2, end_line="2").text == "b\n"
+    assert read_window(p, 100, tail=1).text == "c\n"
+    assert read_window(p, 100, offset="", tail=None).span == ""
+    with pytest.raises(ValueError, match="only one of"):
+        read_window(p, 100, offset=0, tail=1)
+    with pytest.raises(ValueError, match="only one of"):
+        read_window(p, 100, length=1, start_line=1)
+    with pytest.raises(ValueError, match="must not be negative"):
+        read_window(p, 100, start_line=-1)
+    with pytest.raises(ValueError, match="must be an integer"):
+        read_window(p, 100, tail="many")
+
+
+def test_render_notes():
+    assert render(ReadResult("abc", 3, False)) == "abc"
+    assert render(ReadResult("ab", 3, True)).endswith("[truncated: showing the first 2 chars of a 3-byte file]")
+    assert render(ReadResult("", 3, False, "line 9")) == "[nothing at line 9; the file is 3 bytes]"
+    assert render(ReadResult("x", 3, True, "lines 1-1")) == "x\n[lines 1-1 of a 3-byte file, cut to 1 chars]"
+
+
+def test_file_cache_stamp_and_lru():
+    c = FileCache(max_bytes=2 * (2 * 10 + 100))   # room for two 10-char results
+    res = ReadResult("x" * 10, 10, False)
+    c.put(("a",), (10, 1), res)
+    c.put(("b",), (10, 1), res)
+    assert c.get(("a",), (10, 2)) is None          # stale stamp drops the entry
+    assert c.stats()["entries"] == 1
+    c.put(("a",), (10, 2), res)
+    assert c.get(("b",), (10, 1)) is res           # a is now least recently used
+    c.put(("c",), (10, 1), res)
+    assert c.get(("a",), (10, 2)) is None
+    assert c.get(("b",), (10, 1)) is res and c.get(("c",), (10, 1)) is res
+    c.put(("big",), (1, 1), ReadResult("x" * 1000, 1000, False))
+    assert c.get(("big",), (1, 1)) is None
+    assert c.stats()["bytes"] == 2 * (2 * 10 + 100)
+
+
+def test_file_cache_invalidate_path(tmp_path):
+    c = FileCache()
+    p = os.path.abspath(str(tmp_path / "f"))
+    res = ReadResult("x", 1, False)
+    c.put((p, 10), (1, 1), res)
+    c.put((p, 20), (1, 1), res)
+    c.put(("other", 10), (1, 1), res)
+    c.invalidate(p)
+    assert c.stats()["entries"] == 1
+    assert c.get(("other", 10), (1, 1)) is res
+
+
+def test_cached_read_sees_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(fileio, "CACHE", FileCache())
+    p = _file(tmp_path, "first")
+    assert fileio.cached_read(p, 100).text == "first"
+    assert fileio.cached_read(p, 100).text == "first"
+    assert fileio.CACHE.stats()["hits"] == 1
+    with open(p, "w") as f:
+        f.write("second version")
+    assert fileio.cached_read(p, 100).text == "second version"
+    assert fileio.cached_read(p, 100, tail=1).span == "last 1 lines"
+    fileio.CACHE.enabled = False
+    assert fileio.cached_read(p, 3).text == "sec"
+    assert fileio.CACHE.stats()["entries"] == 2
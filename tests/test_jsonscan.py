@@ -0,0 +1,73 @@
+import json
+import time
+
+import pytest
+
+from jsonscan import JsonObjectScanner, extract_last_json_dict, repair_json_dict
+
+STEP = {"tool": "write_file", "args": {"path": "a.py", "text": 'print("}{") \\ "quoted" \\\\'}}
+
+
+def _feed_all(text, size):
+    sc = JsonObjectScanner()
+    found = []
+    for i in range(0, len(text), size):
+        found += sc.feed(text[i:i + size])
+    return found
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_scanner_braces_and_escapes_across_chunk_boundaries(size):
+    text = "Sure {not json} here: " + json.dumps(STEP) + ' and "a } quote" then ' + json.dumps({"final": "x"})
+    assert _feed_all(text, size) == [STEP, {"final": "x"}]
+
+
+def test_scanner_escaped_quote_split_from_backslash():
+    sc = JsonObjectScanner()
+    assert sc.feed('{"t": "a\\') == []
+    assert sc.feed('"}') == []          # still inside the string
+    assert sc.feed('"}') == [{"t": 'a"}'}]
+
+
+def test_scanner_reports_each_object_once():
+    sc = JsonObjectScanner()
+    assert sc.feed('{"a": 1}') == [{"a": 1}]
+    assert sc.feed(' {"b": 2}') == [{"b": 2}]
+    assert sc.feed(" trailing") == []
+
+
+def test_scanner_long_open_string_streams_in_linear_time():
+    # Each chunk must cost O(chunk): rescanning the open string made this take seconds
+    text = 'x = {"k": "a \\"}"}\n' * 4000
+    step = {"tool": "write_file", "args": {"path": "big.py", "text": text}}
+    t0 = time.perf_counter()
+    found = _feed_all("Writing it now. " + json.dumps(step) + " done", 4)
+    assert found == [step]
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_extract_last_json_dict():
+    assert extract_last_json_dict('x {"a": 1} y {"b": "}"} z') == {"b": "}"}
+    assert extract_last_json_dict('{"a": 1} then [1, 2]') == {"a": 1}
+    assert extract_last_json_dict("no objects") is None
+    assert extract_last_json_dict("") is None
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("```json\n{'tool': 'calc', 'args': {'expr': '1+2'},}\n```", {"tool": "calc", "args": {"expr": "1+2"}}),
+    ('{tool: "read_file", args: {path: "a.txt"}}', {"tool": "read_file", "args": {"path": "a.txt"}}),
+    ('{"ok": True, "v": None, "no": False}', {"ok": True, "v": None, "no": False}),
+    ('{"final": "done"', {"final": "done"}),
+    ('{"args": {"items": [1, 2', {"args": {"items": [1, 2]}}),
+    ("{'text': 'say \"hi\"'}", {"text": 'say "hi"'}),
+    ("{'text': 'it\\'s'}", {"text": "it's"}),
+    ('{"text": "two\nlines"}', {"text": "two\nlines"}),
+    ('Here you go: {"final": "x"} hope that helps', {"final": "x"}),
+])
+def test_repair_json_dict(raw, expected):
+    assert repair_json_dict(raw) == expected
+
+
+@pytest.mark.parametrize("raw", ['{"final": "cut off', '{"tool": ', "no braces", "", "{'a': [1, }"])
+def test_repair_json_dict_gives_up(raw):
+    assert repair_json_dict(raw) is None
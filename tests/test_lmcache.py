@@ -0,0 +1,114 @@
+import itertools
+
+import pytest
+
+import lmcache
+from lmcache import PlanCache, ResponseCache, normalize_prompt
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() for lmcache."""
+    now = [1000.0]
+    monkeypatch.setattr(lmcache.time, "time", lambda: now[0])
+    return now
+
+
+def test_plan_key_normalizes_prompt_and_tracks_inputs():
+    k = PlanCache.key("m", "sys", "What  is\tX?")
+    assert k == PlanCache.key("m", "sys", "what is x?")
+    assert k != PlanCache.key("m2", "sys", "what is x?")
+    assert k != PlanCache.key("m", "sys2", "what is x?")
+    assert k == PlanCache.key("m", "sys", "what is x?", None)
+    assert k != PlanCache.key("m", "sys", "what is x?", {"type": "json_schema"})
+    assert normalize_prompt("  A  b ") == "a b"
+
+
+def test_plan_key_exact():
+    k = PlanCache.key("m", "sys", "Write Hi to a.txt", exact=True)
+    assert k != PlanCache.key("m", "sys", "write hi to a.txt", exact=True)
+    assert k != PlanCache.key("m", "sys", "Write Hi to a.txt")
+    assert PlanCache.key("m", "sys", "write hi to a.txt", exact=True) != PlanCache.key("m", "sys", "write hi to a.txt")
+
+
+def test_plan_cache_get_tries_keys_in_order():
+    c = PlanCache()
+    c.put("b", {"n": 2})
+    assert c.get("a", "b") == {"n": 2}
+    c.put("a", {"n": 1})
+    assert c.get("a", "b") == {"n": 1}
+    assert c.get("x", "y") is None
+    assert c.stats() == {"hits": 2, "misses": 1, "entries": 2}
+
+
+def test_plan_cache_returns_copies():
+    c = PlanCache()
+    c.put("k", {"args": {"x": 1}})
+    got = c.get("k")
+    got["args"]["x"] = 2
+    assert c.get("k") == {"args": {"x": 1}}
+    assert c.stats() == {"hits": 2, "misses": 0, "entries": 1}
+
+
+def test_plan_cache_lru_eviction():
+    c = PlanCache(max_entries=2)
+    c.put("a", {"n": 1})
+    c.put("b", {"n": 2})
+    assert c.get("a") is not None     # a is now most recent
+    c.put("c", {"n": 3})
+    assert c.get("b") is None
+    assert c.get("a") == {"n": 1} and c.get("c") == {"n": 3}
+
+
+def test_plan_cache_ttl(clock):
+    c = PlanCache(ttl=10.0)
+    c.put("k", {"n": 1})
+    clock[0] += 9.0
+    assert c.get("k") == {"n": 1}
+    clock[0] += 2.0
+    assert c.get("k") is None
+    assert c.stats()["entries"] == 0
+
+
+def test_plan_cache_persists_to_sqlite(tmp_path, clock):
+    path = str(tmp_path / "plans.db")
+    PlanCache(path=path).put("k", {"n": 1})
+    assert PlanCache(path=path).get("k") == {"n": 1}
+    clock[0] += 100.0
+    assert PlanCache(path=path, ttl=50.0).get("k") is None   # expired rows are purged on open
+
+
+def test_response_cache_key_covers_params():
+    msgs = [{"role": "user", "content": "hi"}]
+    k = ResponseCache.key("m", msgs, temperature=0.0, max_tokens=10)
+    assert k == ResponseCache.key("m", [dict(msgs[0])], max_tokens=10, temperature=0.0)
+    assert k != ResponseCache.key("m", msgs, temperature=0.0, max_tokens=11)
+
+
+def test_response_cache_byte_cap_evicts_least_recently_used(monkeypatch):
+    ticks = itertools.count(1)
+    monkeypatch.setattr(lmcache.time, "time", lambda: float(next(ticks)))
+    c = ResponseCache(max_bytes=10)
+    c.put("a", "aaaa")
+    c.put("b", "bbbb")
+    assert c.get("a") == "aaaa"        # b is now least recently used
+    c.put("c", "cccc")
+    assert c.get("b") is None
+    assert c.get("a") == "aaaa" and c.get("c") == "cccc"
+    c.put("big", "x" * 11)              # larger than the whole cache: not stored
+    assert c.get("big") is None
+    assert c.stats()["bytes"] <= 10
+
+
+def test_response_cache_replace_and_disable():
+    c = ResponseCache(max_bytes=100)
+    c.put("k", "one")
+    c.put("k", "three")
+    assert c.get("k") == "three"
+    assert c.stats()["bytes"] == 5
+    c.enabled = False
+    assert c.get("k") is None
+    c.enabled = True
+    assert c.get("k") == "three"
+    c.clear()
+    assert c.get("k") is None and c.stats()["bytes"] == 0
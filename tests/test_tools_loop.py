@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import tools_loop
+
+
+def _call(i):
+    return {"id": f"c{i}", "type": "function", "function": {"name": "calc", "arguments": json.dumps({"expr": "1+1"})}}
+
+
+def _native_history(turns, per_turn, result="R" * 200):
+    msgs = [{"role": "system", "content": "S" * 40}, {"role": "user", "content": "U" * 40}]
+    for k in range(turns):
+        ids = [per_turn * k + j for j in range(per_turn)]
+        msgs.append({"role": "assistant", "content": "", "tool_calls": [_call(i) for i in ids]})
+        msgs += [{"role": "tool", "tool_call_id": f"c{i}", "content": result} for i in ids]
+    return msgs
+
+
+def _assert_no_orphans(out):
+    owned = set()
+    for m in out:
+        if m["role"] == "assistant":
+            owned = {c["id"] for c in m.get("tool_calls") or []}
+        elif m["role"] == "tool":
+            assert m["tool_call_id"] in owned, [x["role"] for x in out]
+
+
+def test_fit_history_under_budget_is_unchanged():
+    msgs = _native_history(2, 2, result="ok")
+    assert tools_loop.fit_history(msgs, budget=10_000) == msgs
+
+
+def test_fit_history_does_not_modify_input():
+    msgs = _native_history(3, 2)
+    before = json.dumps(msgs)
+    tools_loop.fit_history(msgs, budget=100)
+    assert json.dumps(msgs) == before
+
+
+@pytest.mark.parametrize("per_turn", [1, 2, 3, 4, 5])
+def test_fit_history_drops_tool_call_groups_whole(per_turn):
+    msgs = _native_history(4, per_turn)
+    out = tools_loop.fit_history(msgs, budget=100)
+    assert out[:2] == msgs[:2]
+    assert out[2]["role"] == "system" and "omitted" in out[2]["content"]
+    assert out[3]["role"] == "assistant"
+    _assert_no_orphans(out)
+    assert out[-1] == msgs[-1]
+
+
+def test_fit_history_elides_old_text_mode_results_before_dropping():
+    msgs = [{"role": "system", "content": "S"}, {"role": "user", "content": "U"}]
+    for _ in range(4):
+        msgs.append({"role": "assistant", "content": '{"tool":"read_file","args":{"path":"a.txt"}}'})
+        msgs.append({"role": "system", "content": "TOOL_RESULT: " + "x" * 4000})
+    out = tools_loop.fit_history(msgs, budget=3000)
+    assert len(out) == len(msgs)
+    assert "elided" in out[3]["content"]
+    assert out[-1] == msgs[-1]
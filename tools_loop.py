@@ -1,16 +1,33 @@
 from __future__ import annotations
-import os, sys, json, math, re, time, traceback, argparse
+import os, sys, json, math, re, time, traceback, argparse, asyncio, contextvars
 from typing import Any, Dict, Callable, Optional, List
-from openai import OpenAI
+import fileindex, fileio, lmclient, lmmetrics, lmtrace
+from jsonscan import JsonObjectScanner, extract_last_json_dict, repair_json_dict
+from lmcache import ResponseCache
+from toolspec import (STEP_RESPONSE_FORMAT, TOOL_SCHEMAS, assistant_message, drop_nulls, parse_arguments,
+                      tool_reply, unwrap_step)
 
 # ===== CONFIG =====
-LM = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
-MODEL = "mixtral-latest"
+LM = lmclient.LazyClient()       # pooled, shared with agent.py, built on first use; LMSTUDIO_BASE_URL etc.
+ALM = lmclient.LazyClient(asynchronous=True)   # shared by the *_async path
+MODEL = lmclient.model("mixtral-latest")
 ROOT  = os.path.abspath(os.getcwd())
+READ_MAX_CHARS = 8000           # read_file returns at most this much of a file
 
 ENABLE_DETERMINISTIC = True
 ENABLE_BOOTSTRAP = True
 FORCE_AGENT_PREFIX = "agent:"   # bypass layers 1 & 2 when prompt starts with this
+MAX_STEPS = 40
+HISTORY_TOKEN_BUDGET = 6000     # approx prompt tokens sent per loop step (see fit_history)
+HISTORY_KEEP_RECENT = 4         # trailing messages always sent verbatim
+ELIDED_PREVIEW = 300            # chars of an old tool result kept when it is elided
+STREAM = True                   # stream completions; records TTFT + tok/s per call
+STOP_ON_JSON = True             # agent loop: close the stream once a tool/final object is complete
+NATIVE_TOOLS = False            # agent loop via tools= / structured tool_calls instead of JSON-in-text
+STRUCTURED_OUTPUT = False       # constrain each loop step to STEP_RESPONSE_FORMAT (json_schema)
+# every call here is temperature 0 -> cache replies by content hash (LLM_CACHE_PATH=file, LLM_CACHE=0 bypasses)
+RESPONSE_CACHE = ResponseCache(path=os.environ.get("LLM_CACHE_PATH") or ":memory:",
+                               enabled=os.environ.get("LLM_CACHE","1")!="0")
 
 # ===== COLOUR LOGGING =====
 C = type("C", (), {
@@ -30,17 +47,22 @@ FILE_RE = re.compile(r"(?:\./|/)?[^\s\"']*?\.txt", re.IGNORECASE)
 READ_INTENT = re.compile(r"\b(what\s+is\s+in|show|display|print|read|open)\b", re.IGNORECASE)
 
 # ===== TOOLS =====
-def read_file(path:str)->str:
+def read_file(path:str,offset=None,length=None,start_line=None,end_line=None,tail=None)->str:
     p=os.path.abspath(os.path.join(ROOT,path))
     if not p.startswith(ROOT): raise ValueError("path outside project")
-    if not os.path.isfile(p): raise ValueError(f"not a file: {p}")
-    with open(p,"r",encoding="utf-8",errors="ignore") as f:
-        return f.read()[:8000]
+    if not os.path.isfile(p):
+        found=fileindex.dir_index_for(ROOT).find(os.path.basename(p))
+        raise ValueError(f"not a file: {p}"+(f" (did you mean {', '.join(found[:3])}?)" if found else ""))
+    # bounded: never reads the whole file
+    return fileio.render(fileio.cached_read(p,READ_MAX_CHARS,offset=offset,length=length,
+                                            start_line=start_line,end_line=end_line,tail=tail))
 
 def write_file(path:str,text:str)->str:
     p=os.path.abspath(os.path.join(ROOT,path))
     if not p.startswith(ROOT): raise ValueError("path outside project")
     with open(p,"w",encoding="utf-8") as f: f.write(text)
+    fileio.CACHE.invalidate(p)   # (size, mtime_ns) may not change within one timestamp tick
+    fileindex.changed(ROOT,p)
     return f"[wrote {len(text)} chars to {path}]"
 
 def calc(expr:str)->str:
@@ -53,14 +75,21 @@ def find_number(text:str)->str:
     if not m: raise ValueError("no number found")
     return m.group(0)
 
-TOOLS={"read_file":read_file,"write_file":write_file,"calc":calc,"find_number":find_number}
+SEARCH_MAX_HITS=20
+def search_files(query:str,regex=False)->str:
+    if not str(query).strip(): raise ValueError("missing query")
+    hits=fileindex.index_for(ROOT).search(str(query),regex=regex in (True,1,"1","true","True"),max_hits=SEARCH_MAX_HITS)
+    return fileindex.format_hits(hits,SEARCH_MAX_HITS)
+
+TOOLS={"read_file":read_file,"write_file":write_file,"search_files":search_files,"calc":calc,"find_number":find_number}
 
 # ===== SYSTEM PROMPT =====
 SYSTEM=r"""
 You are a programmatic agent.
 You may call only these tools:
-- read_file(path)
+- read_file(path)  optional: tail=N (last N lines) | start_line, end_line | offset, length (bytes)
 - write_file(path, text)
+- search_files(query)  optional: regex=true; returns path:line hits, cheaper than reading files to find something
 - calc(expr)
 - find_number(text)
 
@@ -74,37 +103,216 @@ Rules:
 - Do NOT invent tools.
 """
 
+# tools are described by TOOL_SCHEMAS in native mode
+NATIVE_SYSTEM=r"""
+You are a programmatic agent.
+Call the provided tools when you need them; results come back as tool messages.
+When you are done, reply with the final answer as plain text.
+Do NOT invent tools.
+"""
+
 # ===== CORE HELPERS =====
-def llm(msgs):
-    out=LM.chat.completions.create(model=MODEL,messages=msgs,temperature=0.0,
-                                   max_tokens=700,response_format={"type":"text"}).choices[0].message.content or ""
-    log("LLM",out[:400].replace("\n"," ")[:400]+("..." if len(out)>400 else ""))
+# elapsed / ttft / tokens / tok_per_s of the most recent llm() call in this thread / asyncio task
+# (a context variable, so concurrent queries don't overwrite each other; all calls: lmmetrics)
+_last_call=contextvars.ContextVar("tools_loop_last_call",default={})
+def last_call_stats(): return _last_call.get()
+
+def _req(msgs,max_tokens=700,response_format=None,**extra):
+    return dict(model=MODEL,messages=msgs,temperature=0.0,max_tokens=max_tokens,
+                response_format=response_format or {"type":"text"},**extra)
+
+def _delta(chunk):
+    return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+
+def _record(t0,ttft,n,stage,outcome="ok",usage=None):
+    el=time.perf_counter()-t0
+    dec=el-ttft if ttft is not None else 0.0
+    pt,ct=lmmetrics.usage_tokens(usage)
+    if ct is None and n:ct=n   # no usage block: one token per chunk
+    _last_call.set(dict(elapsed=el,ttft=ttft,tokens=ct or 0,tok_per_s=((ct or 0)/dec) if dec>0 else 0.0,
+                        cached=outcome=="cached",stage=stage))
+    lmmetrics.record(MODEL,stage,outcome,el,ttft,pt,ct)
+    lmtrace.complete(stage,"llm",t0,el,outcome=outcome,ttft=ttft,prompt_tokens=pt,completion_tokens=ct)
+
+def _outcome(e):
+    return "stopped" if isinstance(e,(GeneratorExit,asyncio.CancelledError)) else f"error: {type(e).__name__}"
+
+def llm_stream(msgs,max_tokens=700,response_format=None,stage="loop"):
+    """Yield text deltas as LM Studio produces them; sets last_call_stats() and lmmetrics on close."""
+    t0=time.perf_counter();ttft=None;n=0;usage=None;outcome="ok";stream=None
+    try:
+        stream=LM.chat.completions.create(**_req(msgs,max_tokens,response_format,stream=True,
+                                                 stream_options={"include_usage":True}))
+        for chunk in stream:
+            usage=getattr(chunk,"usage",None) or usage
+            d=_delta(chunk)
+            if not d:continue
+            if ttft is None:ttft=time.perf_counter()-t0
+            n+=1   # one token per chunk
+            yield d
+    except BaseException as e:
+        outcome=_outcome(e);raise
+    finally:
+        if stream is not None:stream.close()
+        _record(t0,ttft,n,stage,outcome,usage)
+
+async def llm_stream_async(msgs,max_tokens=700,response_format=None,stage="loop"):
+    t0=time.perf_counter();ttft=None;n=0;usage=None;outcome="ok";stream=None
+    try:
+        stream=await ALM.chat.completions.create(**_req(msgs,max_tokens,response_format,stream=True,
+                                                        stream_options={"include_usage":True}))
+        async for chunk in stream:
+            usage=getattr(chunk,"usage",None) or usage
+            d=_delta(chunk)
+            if not d:continue
+            if ttft is None:ttft=time.perf_counter()-t0
+            n+=1
+            yield d
+    except BaseException as e:
+        outcome=_outcome(e);raise
+    finally:
+        if stream is not None:await stream.close()
+        _record(t0,ttft,n,stage,outcome,usage)
+
+def _create(stage,**kw):
+    t0=time.perf_counter()
+    try:resp=LM.chat.completions.create(**kw)
+    except BaseException as e:
+        _record(t0,None,0,stage,_outcome(e));raise
+    _record(t0,None,0,stage,usage=getattr(resp,"usage",None))
+    return resp
+
+async def _create_async(stage,**kw):
+    t0=time.perf_counter()
+    try:resp=await ALM.chat.completions.create(**kw)
+    except BaseException as e:
+        _record(t0,None,0,stage,_outcome(e));raise
+    _record(t0,None,0,stage,usage=getattr(resp,"usage",None))
+    return resp
+
+def _is_step_obj(o):
+    o=unwrap_step(o)
+    return "tool" in o or "final" in o
+
+class _Collector:
+    """Accumulates streamed deltas; add() returns True once a step object is complete (stop_on_json)."""
+    def __init__(self,on_token,stop_on_json):
+        self.parts=[];self.on_token=on_token;self.stopped=False
+        self.sc=JsonObjectScanner() if stop_on_json else None
+    def add(self,d):
+        if self.on_token:self.on_token(d)
+        self.parts.append(d)
+        if self.sc and any(_is_step_obj(o) for o in self.sc.feed(d)):
+            self.stopped=True
+        return self.stopped
+
+def _log_llm(out,streamed,stopped=False):
+    st=last_call_stats()
+    perf=f" [ttft {st['ttft']:.2f}s, {st['tok_per_s']:.1f} tok/s]" if streamed and st.get("ttft") is not None else ""
+    if stopped:perf+=" [stopped at JSON]"
+    log("LLM",out[:400].replace("\n"," ")[:400]+("..." if len(out)>400 else "")+perf)
+
+def _cache_key(msgs,stop_on_json,response_format=None):
+    if not RESPONSE_CACHE.enabled:return None
+    # stop_on_json truncates the reply, so it is part of the key
+    return ResponseCache.key(MODEL,msgs,temperature=0.0,max_tokens=700,stop_on_json=bool(stop_on_json),
+                             response_format=response_format)
+
+def _cache_hit(key,on_token,stage):
+    t0=time.perf_counter()
+    out=RESPONSE_CACHE.get(key) if key else None
+    if out is not None:
+        if on_token:on_token(out)
+        _record(t0,None,0,stage,"cached")
+        log("LLM",out[:400].replace("\n"," ")+("..." if len(out)>400 else "")+" [cached]")
+    return out
+
+def llm(msgs,on_token=None,stop_on_json=False,response_format=None,stage="loop"):
+    """stop_on_json: stop decoding as soon as a top-level {"tool":..}/{"final":..} object is complete."""
+    key=_cache_key(msgs,stop_on_json,response_format)
+    out=_cache_hit(key,on_token,stage)
+    if out is not None:return out
+    if STREAM or on_token or stop_on_json:
+        col=_Collector(on_token,stop_on_json)
+        gen=llm_stream(msgs,response_format=response_format,stage=stage)
+        try:
+            for d in gen:
+                if col.add(d):break
+        finally:
+            gen.close()
+        out="".join(col.parts)
+        _log_llm(out,True,col.stopped)
+    else:
+        out=_create(stage,**_req(msgs,response_format=response_format)).choices[0].message.content or ""
+        _log_llm(out,False)
+    if key:RESPONSE_CACHE.put(key,out)
+    return out
+
+async def llm_async(msgs,on_token=None,stop_on_json=False,response_format=None,stage="loop"):
+    key=_cache_key(msgs,stop_on_json,response_format)
+    out=_cache_hit(key,on_token,stage)
+    if out is not None:return out
+    if STREAM or on_token or stop_on_json:
+        col=_Collector(on_token,stop_on_json)
+        gen=llm_stream_async(msgs,response_format=response_format,stage=stage)
+        try:
+            async for d in gen:
+                if col.add(d):break
+        finally:
+            await gen.aclose()
+        out="".join(col.parts)
+        _log_llm(out,True,col.stopped)
+    else:
+        out=(await _create_async(stage,**_req(msgs,response_format=response_format))).choices[0].message.content or ""
+        _log_llm(out,False)
+    if key:RESPONSE_CACHE.put(key,out)
     return out
 
-def extract_last_json_dict(text):
-    start=-1;depth=0;last=None
-    for i,ch in enumerate(text):
-        if ch=="{":
-            if depth==0:start=i
-            depth+=1
-        elif ch=="}":
-            if depth>0:
-                depth-=1
-                if depth==0 and start!=-1:
-                    try:
-                        j=json.loads(text[start:i+1])
-                        if isinstance(j,dict): last=j
-                    except: pass
-    return last
+def _tools_req(msgs):
+    return dict(model=MODEL,messages=msgs,tools=TOOL_SCHEMAS,tool_choice="auto",temperature=0.0,max_tokens=700)
+
+def _log_tools(reply,cached=False):
+    calls=", ".join(f"{c['name']}({c['arguments']})" for c in reply["tool_calls"])
+    shown=(f"tool_calls: {calls}" if calls else reply["content"]).replace("\n"," ")
+    log("LLM",shown[:400]+("..." if len(shown)>400 else "")+(" [cached]" if cached else ""))
+
+def llm_tools(msgs,stage="loop"):
+    """Native tool-calling step: returns toolspec.tool_reply() output (cached like llm())."""
+    key=ResponseCache.key(MODEL,msgs,tools=TOOL_SCHEMAS,temperature=0.0,max_tokens=700) if RESPONSE_CACHE.enabled else None
+    hit=RESPONSE_CACHE.get(key) if key else None
+    if hit is not None:
+        reply=json.loads(hit);_record(time.perf_counter(),None,0,stage,"cached");_log_tools(reply,True)
+        return reply
+    reply=tool_reply(_create(stage,**_tools_req(msgs)).choices[0].message)
+    _log_tools(reply)
+    if key:RESPONSE_CACHE.put(key,json.dumps(reply))
+    return reply
+
+async def llm_tools_async(msgs,stage="loop"):
+    key=ResponseCache.key(MODEL,msgs,tools=TOOL_SCHEMAS,temperature=0.0,max_tokens=700) if RESPONSE_CACHE.enabled else None
+    hit=RESPONSE_CACHE.get(key) if key else None
+    if hit is not None:
+        reply=json.loads(hit);_record(time.perf_counter(),None,0,stage,"cached");_log_tools(reply,True)
+        return reply
+    reply=tool_reply((await _create_async(stage,**_tools_req(msgs))).choices[0].message)
+    _log_tools(reply)
+    if key:RESPONSE_CACHE.put(key,json.dumps(reply))
+    return reply
 
 def run_tool(n,a):
     log("ACT",f"{n} {a}")
-    try:
-        r=str(TOOLS[n](**a))
-        log("TOOL",f"{len(r)} chars")
-        return r
-    except Exception as e:
-        return f"ERROR: {e}"
+    with lmtrace.span(n,"tool") as sp:
+        try:
+            r=str(TOOLS[n](**a))
+            log("TOOL",f"{len(r)} chars");sp.set(chars=len(r))
+            return r
+        except Exception as e:
+            sp.set(error=type(e).__name__)
+            return f"ERROR: {e}"
+
+async def run_tool_async(n,a):
+    # tools block on file I/O; run them in a worker thread
+    return await asyncio.to_thread(run_tool,n,a)
 
 def _first_path_in(t):
     if not t:return None
@@ -115,6 +323,7 @@ def _is_read_intent(text: str) -> bool:
     return bool(READ_INTENT.search(text or ""))
 
 # ===== LAYERS =====
+@lmtrace.traced("deterministic")
 def deterministic_execute(p):
     if not ENABLE_DETERMINISTIC: return None
     if re.search(r"\bwhat\s+is\s+in\b",p,re.I) and ".txt" in p:
@@ -124,16 +333,78 @@ def deterministic_execute(p):
             except Exception as e:return f"[error: {e}]"
     return None
 
-def _bootstrap_file_read(msgs,path):
+@lmtrace.traced("bootstrap")
+def _bootstrap_file_read(msgs,path,native=False):
     if not ENABLE_BOOTSTRAP: return ""
     log("SYS",f"bootstrap read_file {path}")
     r=run_tool("read_file",{"path":path})
+    if native:
+        call={"id":"bootstrap_0","name":"read_file","arguments":json.dumps({"path":path})}
+        msgs.append(assistant_message({"content":"","tool_calls":[call]}))
+        msgs.append({"role":"tool","tool_call_id":call["id"],"content":r})
+        return r
     msgs.append({"role":"assistant","content":json.dumps({"tool":"read_file","args":{"path":path}})})
     msgs.append({"role":"system","content":f"TOOL_RESULT: {r}"})
     return r
 
+# ===== CONTEXT WINDOW =====
+def _est_tokens(m):
+    # ~4 chars per token is close enough for budgeting; +4 for role/framing
+    n=len(m.get("content") or "")
+    for c in m.get("tool_calls") or []:n+=len(c["function"]["arguments"])+len(c["function"]["name"])
+    return n//4+4
+
+def _is_tool_result(m):
+    return m["role"]=="tool" or (m["role"]=="system" and (m.get("content") or "").startswith("TOOL_RESULT: "))
+
+def _elide(m,keep):
+    c=m["content"]
+    if len(c)<=keep+64:return m
+    return {**m,"content":f"{c[:keep]}\n...[{len(c)-keep} more chars elided from this earlier tool result]"}
+
+def fit_history(msgs,budget=None):
+    """The message list to send for this step, within ~budget tokens.
+
+    msgs itself is never modified. The system prompt, the user's request and
+    the last HISTORY_KEEP_RECENT messages (extended back to the assistant turn
+    that owns any tool replies among them) go verbatim; older tool results are
+    cut to an ELIDED_PREVIEW-char head first, then recent ones (except the
+    newest), and finally the oldest turns are dropped if still over budget.
+    """
+    budget=HISTORY_TOKEN_BUDGET if budget is None else budget
+    out=list(msgs)
+    total=sum(_est_tokens(m) for m in out)
+    elided=0
+    recent=max(2,len(out)-HISTORY_KEEP_RECENT)
+    for lo,hi in ((2,recent),(recent,len(out)-1)):
+        for i in range(lo,hi):
+            if total<=budget:break
+            if _is_tool_result(out[i]):
+                small=_elide(out[i],ELIDED_PREVIEW)
+                if small is not out[i]:
+                    total+=_est_tokens(small)-_est_tokens(out[i])
+                    out[i]=small;elided+=1
+    # Still over: drop the oldest middle turns. The kept tail starts at the assistant turn owning
+    # any role=tool replies in it, and a dropped turn takes its replies along, so none is orphaned.
+    keep=len(out)-HISTORY_KEEP_RECENT
+    while 2<keep<len(out) and out[keep]["role"]=="tool":keep-=1
+    dropped=0
+    while total>budget and keep>2:
+        total-=_est_tokens(out.pop(2));dropped+=1;keep-=1
+        while keep>2 and out[2]["role"]=="tool":
+            total-=_est_tokens(out.pop(2));dropped+=1;keep-=1
+    if dropped:
+        note={"role":"system","content":f"[{dropped} earlier messages omitted to fit the context window]"}
+        out.insert(2,note);total+=_est_tokens(note)
+    log("SYS",f"prompt ~{total} tok, {len(out)} msgs"
+        +(f", {elided} tool results elided" if elided else "")+(f", {dropped} dropped" if dropped else ""))
+    return out
+
 # ===== AGENT CORE =====
-def run_query(q):
+RETRY_MSG={"role":"user","content":"Return ONE JSON object only: {'tool':..., 'args':...} OR {'final':'...' }."}
+
+def _open_query(q,native=False):
+    """Layers 1 & 2. Returns (q, deterministic answer or None, initial msgs)."""
     forced_agent = q.lower().startswith(FORCE_AGENT_PREFIX)
     if forced_agent:
         q = q[len(FORCE_AGENT_PREFIX):].lstrip()
@@ -144,53 +415,169 @@ def run_query(q):
         det=deterministic_execute(q)
         if det is not None:
             log("RES",f"deterministic -> {det[:80]}...")
-            return det
+            return q,det,None
 
-    msgs=[{"role":"system","content":SYSTEM.strip()},
+    msgs=[{"role":"system","content":(NATIVE_SYSTEM if native else SYSTEM).strip()},
           {"role":"user","content":q}]
 
     if ENABLE_BOOTSTRAP and not forced_agent:
         path=_first_path_in(q)
         if (path is not None) or (" file" in q.lower()):
-            if path is None and os.path.isfile(os.path.join(ROOT,"notes.txt")):
+            if path is None and fileindex.dir_index_for(ROOT).has("notes.txt"):
                 path="./notes.txt"
             if path:
-                _bootstrap_file_read(msgs,path)
+                _bootstrap_file_read(msgs,path,native)
+    return q,None,msgs
+
+def _step_format():
+    return STEP_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None
+
+def _parse_step(raw):
+    if STRUCTURED_OUTPUT:
+        # schema-constrained: the whole reply is the object
+        try:
+            j=json.loads(raw)
+            if isinstance(j,dict):return unwrap_step(j)
+        except Exception:
+            pass
+    j=extract_last_json_dict(raw)
+    return unwrap_step(j) if j else j
+
+# malformed replies fixed locally vs. sent back to the model with RETRY_MSG
+repair_stats={"repaired":0,"retries":0}
+
+def _next_step(raw,msgs):
+    """Interpret one loop reply: ("tool",(name,args)) | ("final",text) | (None,None) to go again."""
+    data=_parse_step(raw)
+    if not data:
+        fixed=repair_json_dict(raw)
+        if fixed and _is_step_obj(fixed):
+            repair_stats["repaired"]+=1
+            log("PARSE",f"repaired malformed JSON locally (round trips saved: {repair_stats['repaired']})")
+            data=unwrap_step(fixed)
+    if not data:
+        repair_stats["retries"]+=1
+        msgs.append(dict(RETRY_MSG))
+        return None,None
+
+    tool=data.get("tool")
+    args=drop_nulls(data["args"]) if isinstance(data.get("args"),dict) else None
+    final=data.get("final")
+
+    if tool and args is not None:
+        msgs.append({"role":"assistant","content":json.dumps({"tool":tool,"args":args})})
+        return "tool",(tool,args)
+    if final is not None:
+        return "final",final
+    return None,None
+
+def _finish(q,final,last_tool_result):
+    if _is_read_intent(q) and last_tool_result is not None:
+        log("RES",f"final (tool-trusted) -> {last_tool_result[:120]}...")
+        return last_tool_result if last_tool_result else "[empty file]"
+    log("RES",f"final -> {final}")
+    return str(final)
+
+def _native_tool_results(reply,msgs):
+    """Append the assistant tool_calls turn; return the calls as (id, name, args)."""
+    msgs.append(assistant_message(reply))
+    return [(c["id"],c["name"],parse_arguments(c["arguments"])) for c in reply["tool_calls"]]
+
+@lmtrace.traced("run_query_native")
+def run_query_native(q):
+    """Agent loop over native tool_calls (NATIVE_TOOLS); same layers 1 & 2 as run_query."""
+    q,det,msgs=_open_query(q,native=True)
+    if det is not None:return det
 
     last_tool_result=None
-    for _ in range(40):
-        raw=llm(msgs).strip()
-        data=extract_last_json_dict(raw)
-        if not data:
-            msgs.append({"role":"user","content":
-                "Return ONE JSON object only: {'tool':..., 'args':...} OR {'final':'...' }."})
-            continue
+    for step in range(1,MAX_STEPS+1):
+        with lmtrace.span(f"step {step}","loop"):
+            reply=llm_tools(fit_history(msgs),stage=f"loop step {step}")
+            if not reply["tool_calls"]:
+                return _finish(q,reply["content"].strip(),last_tool_result)
+            for call_id,name,args in _native_tool_results(reply,msgs):
+                result=run_tool(name,args)
+                last_tool_result=result
+                msgs.append({"role":"tool","tool_call_id":call_id,"content":result})
 
-        tool=data.get("tool")
-        args=data.get("args") if isinstance(data.get("args"),dict) else None
-        final=data.get("final")
+    log("WARN","loop limit reached")
+    return "ERROR: exceeded tool loop limit"
 
-        if tool and args is not None:
-            msgs.append({"role":"assistant","content":json.dumps({"tool":tool,"args":args})})
-            result=run_tool(tool,args)
-            last_tool_result=result
-            msgs.append({"role":"system","content":f"TOOL_RESULT: {result}"})
-            continue
+@lmtrace.traced("run_query_native")
+async def run_query_native_async(q):
+    q,det,msgs=await asyncio.to_thread(_open_query,q,True)
+    if det is not None:return det
 
-        if final is not None:
-            if _is_read_intent(q) and last_tool_result is not None:
-                log("RES",f"final (tool-trusted) -> {last_tool_result[:120]}...")
-                return last_tool_result if last_tool_result else "[empty file]"
-            log("RES",f"final -> {final}")
-            return str(final)
+    last_tool_result=None
+    for step in range(1,MAX_STEPS+1):
+        with lmtrace.span(f"step {step}","loop"):
+            reply=await llm_tools_async(fit_history(msgs),stage=f"loop step {step}")
+            if not reply["tool_calls"]:
+                return _finish(q,reply["content"].strip(),last_tool_result)
+            for call_id,name,args in _native_tool_results(reply,msgs):
+                result=await run_tool_async(name,args)
+                last_tool_result=result
+                msgs.append({"role":"tool","tool_call_id":call_id,"content":result})
 
     log("WARN","loop limit reached")
     return "ERROR: exceeded tool loop limit"
 
-def plain_chat(p):
-    msgs=[{"role":"system","content":"You are a helpful assistant."},
-          {"role":"user","content":p}]
-    r=llm(msgs).strip()
+@lmtrace.traced("run_query")
+def run_query(q):
+    if NATIVE_TOOLS:return run_query_native(q)
+    q,det,msgs=_open_query(q)
+    if det is not None:return det
+
+    last_tool_result=None
+    for step in range(1,MAX_STEPS+1):
+        with lmtrace.span(f"step {step}","loop"):
+            kind,val=_next_step(llm(fit_history(msgs),stop_on_json=STOP_ON_JSON,response_format=_step_format(),
+                                      stage=f"loop step {step}").strip(),msgs)
+            if kind=="tool":
+                result=run_tool(*val)
+                last_tool_result=result
+                msgs.append({"role":"system","content":f"TOOL_RESULT: {result}"})
+            elif kind=="final":
+                return _finish(q,val,last_tool_result)
+
+    log("WARN","loop limit reached")
+    return "ERROR: exceeded tool loop limit"
+
+@lmtrace.traced("run_query")
+async def run_query_async(q):
+    """run_query() on the shared AsyncOpenAI client, so many queries can share one event loop."""
+    if NATIVE_TOOLS:return await run_query_native_async(q)
+    q,det,msgs=await asyncio.to_thread(_open_query,q)
+    if det is not None:return det
+
+    last_tool_result=None
+    for step in range(1,MAX_STEPS+1):
+        with lmtrace.span(f"step {step}","loop"):
+            kind,val=_next_step((await llm_async(fit_history(msgs),stop_on_json=STOP_ON_JSON,
+                                                   response_format=_step_format(),stage=f"loop step {step}")).strip(),msgs)
+            if kind=="tool":
+                result=await run_tool_async(*val)
+                last_tool_result=result
+                msgs.append({"role":"system","content":f"TOOL_RESULT: {result}"})
+            elif kind=="final":
+                return _finish(q,val,last_tool_result)
+
+    log("WARN","loop limit reached")
+    return "ERROR: exceeded tool loop limit"
+
+def _chat_msgs(p):
+    return [{"role":"system","content":"You are a helpful assistant."},
+            {"role":"user","content":p}]
+
+@lmtrace.traced("plain_chat")
+def plain_chat(p,on_token=None):
+    r=llm(_chat_msgs(p),on_token=on_token,stage="chat").strip()
+    log("RES",f"chat -> {r[:120]}...")
+    return r
+
+@lmtrace.traced("plain_chat")
+async def plain_chat_async(p,on_token=None):
+    r=(await llm_async(_chat_msgs(p),on_token=on_token,stage="chat")).strip()
     log("RES",f"chat -> {r[:120]}...")
     return r
 
@@ -204,5 +591,8 @@ if __name__=="__main__":
         if q.lower() in {"quit","exit"}:break
         r=run_query(q)
         if r.strip().lower()=="i cannot do that":
-            r=plain_chat(q)
+            print("AI > ",end="",flush=True)
+            plain_chat(q,on_token=lambda d:print(d,end="",flush=True))
+            print()
+            continue
         print("AI >",r)
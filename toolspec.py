@@ -0,0 +1,161 @@
+"""JSON schemas for the agents' tools, for the OpenAI `tools=` parameter."""
+from __future__ import annotations
+import json
+from typing import Any, Dict, List, Optional
+
+
+def _fn(name: str, description: str, optional: Optional[Dict[str, Dict[str, Any]]] = None,
+        **props: str) -> Dict[str, Any]:
+    """Function tool schema: **props are required strings, optional maps name -> property schema."""
+    properties = {k: {"type": "string", "description": v} for k, v in props.items()}
+    properties.update(optional or {})
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": list(props),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def _int(description: str) -> Dict[str, Any]:
+    return {"type": "integer", "minimum": 0, "description": description}
+
+
+# read_file's optional window (see fileio.read_window); pick at most one form
+READ_WINDOW_PROPS = {
+    "offset": _int("Byte offset to start reading at"),
+    "length": _int("Number of bytes to read from offset"),
+    "start_line": _int("First line to return (1-based)"),
+    "end_line": _int("Last line to return (inclusive)"),
+    "tail": _int("Return only the last N lines"),
+}
+
+
+TOOL_SCHEMAS: List[Dict[str, Any]] = [
+    _fn("read_file", "Read a text file inside the project: its head by default, or a byte range "
+        "(offset/length), a line range (start_line/end_line) or the last N lines (tail).",
+        optional=READ_WINDOW_PROPS, path="File path relative to the project root"),
+    _fn("write_file", "Write text to a file inside the project, replacing its contents.",
+        path="File path relative to the project root", text="Full text to write"),
+    _fn("search_files", "Search the project's text files; returns path:line hits with the matching lines.",
+        optional={"regex": {"type": "boolean", "description": "Treat query as a regular expression"}},
+        query="Words that must appear on the line (or a regex when regex is true)"),
+    _fn("calc", "Evaluate an arithmetic expression (+ - * / ^ and parentheses).",
+        expr="The expression, e.g. (3+4)*2"),
+    _fn("find_number", "Return the first number that appears in some text.",
+        text="Text to search"),
+]
+
+
+def tool_reply(message: Any) -> Dict[str, Any]:
+    """Flatten a chat completion message into {"content", "tool_calls": [{id, name, arguments}]}.
+
+    arguments stays the raw JSON string the model produced; the result is
+    plain JSON so it can be cached and replayed.
+    """
+    calls = []
+    for i, tc in enumerate(getattr(message, "tool_calls", None) or []):
+        calls.append({
+            "id": tc.id or f"call_{i}",
+            "name": tc.function.name,
+            "arguments": tc.function.arguments or "{}",
+        })
+    return {"content": message.content or "", "tool_calls": calls}
+
+
+def parse_arguments(raw: str) -> Dict[str, Any]:
+    """Decode a tool call's arguments; anything that is not a JSON object becomes {}."""
+    try:
+        obj = json.loads(raw or "{}")
+    except Exception:
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+
+def assistant_message(reply: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the assistant turn (with tool_calls) to append to the history."""
+    return {
+        "role": "assistant",
+        "content": reply["content"],
+        "tool_calls": [
+            {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+            for c in reply["tool_calls"]
+        ],
+    }
+
+
+# ----- response_format=json_schema (structured output) -----
+TOOL_NAMES = [t["function"]["name"] for t in TOOL_SCHEMAS]
+
+# strict json_schema mode needs every property listed in "required": optional
+# args are nullable instead, and drop_nulls() removes the nulls again
+_ARG_TYPES = {"path": "string", "text": "string", "expr": "string", "query": "string", "regex": "boolean",
+              **{k: "integer" for k in READ_WINDOW_PROPS}}
+
+_ARGS_SCHEMA = {
+    "type": "object",
+    "properties": {k: {"type": [t, "null"]} for k, t in _ARG_TYPES.items()},
+    "required": list(_ARG_TYPES),
+    "additionalProperties": False,
+}
+
+
+def drop_nulls(args: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in args.items() if v is not None}
+
+
+def json_schema_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+# agent.py planner: {route, tool, args, confidence}
+PLAN_RESPONSE_FORMAT = json_schema_format("route_plan", {
+    "type": "object",
+    "properties": {
+        "route": {"type": "string", "enum": ["tool", "chat"]},
+        "tool": {"anyOf": [{"type": "string", "enum": TOOL_NAMES}, {"type": "null"}]},
+        "args": _ARGS_SCHEMA,
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["route", "tool", "args", "confidence"],
+    "additionalProperties": False,
+})
+
+# tools_loop step: {"step": {tool, args} | {final}}; strict mode does not allow a
+# top-level anyOf, so the union is wrapped (toolspec.unwrap_step undoes it)
+STEP_RESPONSE_FORMAT = json_schema_format("agent_step", {
+    "type": "object",
+    "properties": {
+        "step": {
+            "anyOf": [
+                {
+                    "type": "object",
+                    "properties": {"tool": {"type": "string", "enum": TOOL_NAMES}, "args": _ARGS_SCHEMA},
+                    "required": ["tool", "args"],
+                    "additionalProperties": False,
+                },
+                {
+                    "type": "object",
+                    "properties": {"final": {"type": "string"}},
+                    "required": ["final"],
+                    "additionalProperties": False,
+                },
+            ],
+        },
+    },
+    "required": ["step"],
+    "additionalProperties": False,
+})
+
+
+def unwrap_step(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """{"step": {...}} (STEP_RESPONSE_FORMAT) -> {...}; other objects pass through."""
+    step = obj.get("step")
+    return step if isinstance(step, dict) and len(obj) == 1 else obj
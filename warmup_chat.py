@@ -1,8 +1,8 @@
-from openai import OpenAI
+import lmclient
 
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+client = lmclient.client()
 #MODEL = "llama3-8b"  # or whichever chat model you listed earlier
-MODEL = "mixtral-latest"
+MODEL = lmclient.model("mixtral-latest")
 
 intro = """
 You’re an AI researcher’s assistant. Keep replies short, sharp, and accurate.